@@ -14,6 +14,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import json
 import re
 import ConfigParser
 
@@ -25,20 +27,30 @@ from devstack import log as logging
 from devstack import settings
 from devstack import shell as sh
 from devstack import utils
+from devstack import workers
 
 LOG = logging.getLogger("devstack.cfg")
 ENV_PAT = re.compile(r"^\s*\$\{([\w\d]+):\-(.*)\}\s*$")
 SUB_MATCH = re.compile(r"(?:\$\(([\w\d]+):([\w\d]+))\)")
 CACHE_MSG = "(value will now be internally cached)"
 
+# Compiled values are kept (in the root directory) between runs in this file
+CACHE_FN = "config.cache"
+CACHE_VER = 0x1
 
-def get_config(cfg_fn=None, cfg_cls=None):
+# Values in these sections are never written to the cache (they may be secrets)
+UNCACHED_SECTIONS = ['passwords']
+
+
+def get_config(cfg_fn=None, cfg_cls=None, cache_fn=None):
     if not cfg_fn:
         cfg_fn = sh.canon_path(settings.STACK_CONFIG_LOCATION)
     if not cfg_cls:
         cfg_cls = StackConfigParser
     config_instance = cfg_cls()
     config_instance.read(cfg_fn)
+    if isinstance(config_instance, StackConfigParser):
+        config_instance.compile(cache_fn)
     return config_instance
 
 
@@ -83,6 +95,14 @@ class StackConfigParser(IgnoreMissingConfigParser):
     def __init__(self):
         IgnoreMissingConfigParser.__init__(self)
         self.configs_fetched = dict()
+        # Filled in (all at once) by compile()
+        self.compiled = dict()
+        self.references = dict()
+        self.read_fns = list()
+
+    def read(self, filenames):
+        self.read_fns = IgnoreMissingConfigParser.read(self, filenames)
+        return self.read_fns
 
     def _resolve_value(self, section, option, value_gotten):
         if section == 'host' and option == 'ip':
@@ -101,30 +121,147 @@ class StackConfigParser(IgnoreMissingConfigParser):
     def get(self, section, option):
         key = cfg_helpers.make_id(section, option)
         if key in self.configs_fetched:
-            value = self.configs_fetched.get(key)
-            LOG.debug("Fetched cached value [%s] for param [%s]" % (value, key))
+            return self.configs_fetched.get(key)
+        if key in self.compiled:
+            value = self.compiled.get(key)
         else:
             LOG.debug("Fetching value for param [%s]" % (key))
             gotten_value = self._get_bashed(section, option)
             value = self._resolve_value(section, option, gotten_value)
             LOG.debug("Fetched [%s] for [%s] %s" % (value, key, CACHE_MSG))
-            self.configs_fetched[key] = value
+        self.configs_fetched[key] = value
         return value
 
     def set(self, section, option, value):
         key = cfg_helpers.make_id(section, option)
         LOG.audit("Setting config value [%s] for param [%s]" % (value, key))
         self.configs_fetched[key] = value
+        self._invalidate(key)
         IgnoreMissingConfigParser.set(self, section, option, value)
 
+    def _invalidate(self, key):
+        # Anything compiled from the old value must be resolved again
+        dependents = workers.invert_dependencies(self.references.keys(), self.references)
+        todo = [key]
+        while todo:
+            for dep in dependents.get(todo.pop(), list()):
+                if dep in self.compiled:
+                    self.compiled.pop(dep)
+                    todo.append(dep)
+
+    def _references(self, section, option):
+        # The (section, option) pairs the value of an option will be made from
+        value = IgnoreMissingConfigParser.get(self, section, option)
+        if value is None:
+            return list()
+        mtch = ENV_PAT.match(value)
+        if not mtch or env.get_key(mtch.group(1).strip()) is not None:
+            return list()
+        return SUB_MATCH.findall(mtch.group(2).strip())
+
+    def _cache_key(self):
+        # Anything that can change what the options resolve to
+        env_keys = set()
+        for section in self.sections():
+            for option in self.options(section):
+                mtch = ENV_PAT.match(IgnoreMissingConfigParser.get(self, section, option) or '')
+                if mtch:
+                    env_keys.add(mtch.group(1).strip())
+        what = dict()
+        what['version'] = CACHE_VER
+        what['files'] = [(fn, sh.getmtime(fn), sh.getsize(fn)) for fn in self.read_fns]
+        what['env'] = [(k, env.get_key(k)) for k in sorted(env_keys)]
+        what['interfaces'] = utils.get_interfaces()
+        return hashlib.md5(json.dumps(what, sort_keys=True)).hexdigest()
+
+    def _load_cache(self, cache_fn, key):
+        if not sh.isfile(cache_fn):
+            return False
+        try:
+            cached = json.loads(sh.load_file(cache_fn, quiet=True))
+        except (IOError, ValueError):
+            LOG.debug("Ignoring unreadable configuration cache %s" % (cache_fn))
+            return False
+        if type(cached) is not dict or cached.get('key') != key:
+            LOG.debug("Configuration cache %s is out of date" % (cache_fn))
+            return False
+        # Json gives back unicode, the rest of the configuration is in bytes
+        self.compiled = dict()
+        for (k, v) in (cached.get('values') or dict()).items():
+            if v is not None:
+                v = v.encode('utf-8')
+            self.compiled[k.encode('utf-8')] = v
+        self.references = dict()
+        for (k, refs) in (cached.get('references') or dict()).items():
+            self.references[k.encode('utf-8')] = [r.encode('utf-8') for r in refs]
+        return True
+
+    def _save_cache(self, cache_fn, key):
+        values = dict()
+        for (k, v) in self.compiled.items():
+            if k.split("/")[0] not in UNCACHED_SECTIONS:
+                values[k] = v
+        cached = dict()
+        cached['key'] = key
+        cached['values'] = values
+        cached['references'] = self.references
+        sh.write_file(cache_fn, json.dumps(cached), quiet=True)
+
+    def compile(self, cache_fn=None):
+        """
+        Resolves every option (and any references it makes to other options)
+        up front so that later lookups are simple dictionary fetches, a
+        reference cycle between options raises a ConfigException. When a
+        cache file is given values are loaded from (and saved to) it.
+        """
+        cache_key = None
+        if cache_fn:
+            cache_key = self._cache_key()
+            if self._load_cache(cache_fn, cache_key):
+                LOG.debug("Loaded %s compiled configuration values from %s." % (len(self.compiled), cache_fn))
+                return len(self.compiled)
+        names = dict()
+        references = dict()
+        for section in self.sections():
+            for option in self.options(section):
+                key = cfg_helpers.make_id(section, option)
+                names[key] = (section, option)
+                references[key] = [cfg_helpers.make_id(s, o) for (s, o) in self._references(section, option)]
+        try:
+            ordered = workers.topological_order(sorted(names.keys()), references)
+        except excp.DependencyException as e:
+            msg = "Configuration references can not be resolved: %s" % (e)
+            raise excp.ConfigException(msg)
+        self.references = references
+        self.compiled = dict()
+        for key in ordered:
+            (section, option) = names[key]
+            gotten_value = self._get_bashed(section, option)
+            self.compiled[key] = self._resolve_value(section, option, gotten_value)
+        LOG.debug("Compiled %s configuration values." % (len(self.compiled)))
+        if cache_fn:
+            self._save_cache(cache_fn, cache_key)
+        return len(self.compiled)
+
+    def _lookup(self, section, option):
+        # Like get() but does not mark the value as fetched
+        key = cfg_helpers.make_id(section, option)
+        if key in self.configs_fetched:
+            return self.configs_fetched.get(key)
+        if key in self.compiled:
+            return self.compiled.get(key)
+        return self.get(section, option)
+
     def _resolve_replacements(self, value):
-        LOG.debug("Performing simple replacement on [%s]", value)
 
         #allow for our simple replacement to occur
         def replacer(match):
             section = match.group(1)
             option = match.group(2)
-            return self.getdefaulted(section, option, '')
+            val = self._lookup(section, option)
+            if not val or not val.strip():
+                return ''
+            return val
 
         return SUB_MATCH.sub(replacer, value)
 
@@ -142,15 +279,11 @@ class StackConfigParser(IgnoreMissingConfigParser):
                 raise excp.BadParamException(msg)
             env_value = env.get_key(env_key)
             if env_value is None:
-                LOG.debug("Extracting value from config provided default value [%s]" % (def_val))
                 extracted_val = self._resolve_replacements(def_val)
-                LOG.debug("Using config provided default value [%s] (no environment key)" % (extracted_val))
             else:
                 extracted_val = env_value
-                LOG.debug("Using enviroment provided value [%s]" % (extracted_val))
         else:
             extracted_val = value
-            LOG.debug("Using raw config provided value [%s]" % (extracted_val))
         return extracted_val
 
 
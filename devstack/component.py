@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import weakref
 
 from devstack import cfg_helpers
@@ -85,6 +86,9 @@ class ComponentBase(object):
         self.packager = runner.pkg_manager
         self.distro = runner.distro
 
+        # When resuming (or converging) we continue on with any existing traces
+        self.keep_traces = runner.resume or runner.converge
+
         # Required component directories
         self.component_dir = component_dir
         self.trace_dir = sh.joinpths(self.component_dir,
@@ -120,6 +124,24 @@ class ComponentBase(object):
     def warm_configs(self):
         pass
 
+    def phase_inputs(self, phase):
+        # What the given phase depends on (used to tell if it needs to
+        # run again when converging), none means it always needs to run
+        return None
+
+    def batch_packages(self):
+        # The packages the runner may install (for all components at once)
+        # before this component installs
+        return list()
+
+    def batch_pips(self):
+        # Same as the above but for pips (installed after the packages)
+        return list()
+
+    def batch_pre_install(self):
+        # What has to happen before the above are installed
+        pass
+
     def is_started(self):
         return tr.TraceReader(tr.trace_fn(self.trace_dir, tr.START_TRACE)).exists()
 
@@ -131,22 +153,22 @@ class PkgInstallComponent(ComponentBase):
     def __init__(self, *args, **kargs):
         ComponentBase.__init__(self, *args, **kargs)
         self.tracewriter = tr.TraceWriter(tr.trace_fn(self.trace_dir,
-                                                      tr.IN_TRACE))
+                                                      tr.IN_TRACE),
+                                          break_if_there=(not self.keep_traces),
+                                          buffered=True)
         self.packages = kargs.get('packages', list())
+        # Set by the runner once it installed our packages (and pips) for us
+        self.packages_batched = False
 
     def _get_download_locations(self):
         return list()
 
     def download(self):
-        locations = self._get_download_locations()
-        base_dir = self.app_dir
-        for location_info in locations:
+        targets = self._get_download_targets()
+        downloads = list()
+        for (location_info, target_loc) in targets:
             uri_tuple = location_info["uri"]
             branch_tuple = location_info.get("branch")
-            sub_dir = location_info.get("subdir")
-            target_loc = base_dir
-            if sub_dir:
-                target_loc = sh.joinpths(base_dir, sub_dir)
             branch = None
             if branch_tuple:
                 (cfg_section, cfg_key) = branch_tuple
@@ -161,21 +183,83 @@ class PkgInstallComponent(ComponentBase):
                 msg = "No uri entry found at config location [%s]" % \
                     (cfg_helpers.make_id(cfg_section, cfg_key))
                 raise excp.ConfigException(msg)
-            # Activate da download!
-            self.tracewriter.download_happened(target_loc, uri)
-            dirs_made = self._do_download(uri, target_loc, branch)
-            # Here we ensure this is always added so that
-            # if a keep old happens then this of course
-            # won't be recreated, but if u uninstall without keeping old
-            # then this won't be deleted this time around
-            # adding it in is harmless and will make sure its removed.
-            if target_loc not in dirs_made:
-                dirs_made.append(target_loc)
+            downloader = self._get_downloader(uri, target_loc, branch)
+            # Traced before anything is downloaded so that a partial
+            # download (ie an interrupted clone) still gets removed
+            self.tracewriter.dirs_made(target_loc)
+            downloads.append((uri, downloader,
+                              functools.partial(self._download_finished, uri, target_loc)))
+        # Activate da downloads! (the manager is shared by all the components
+        # so only so many of them are downloading at any one time)
+        self.runner.download_manager.run(downloads)
+        return len(targets)
+
+    def _download_finished(self, uri, target_loc, dirs_made):
+        self.tracewriter.download_happened(target_loc, uri)
+        # The target itself was traced before the download started (even
+        # when it already existed, so that if a keep old happens then this
+        # of course won't be recreated, but if u uninstall without keeping
+        # old then it will be removed)
+        dirs_made = [d for d in dirs_made if d != target_loc]
+        if dirs_made:
             self.tracewriter.dirs_made(*dirs_made)
-        return len(locations)
 
-    def _do_download(self, uri, target_dir, branch):
-        return down.GitDownloader(self.distro, uri, target_dir, branch).download()
+    def _get_download_targets(self):
+        targets = list()
+        for location_info in self._get_download_locations():
+            target_loc = self.app_dir
+            sub_dir = location_info.get("subdir")
+            if sub_dir:
+                target_loc = sh.joinpths(self.app_dir, sub_dir)
+            targets.append((location_info, target_loc))
+        return targets
+
+    def _download_inputs(self):
+        inputs = list()
+        for (location_info, target_loc) in self._get_download_targets():
+            what = dict()
+            what['target'] = target_loc
+            what['head'] = down.git_head(self.distro, target_loc)
+            for key in ['uri', 'branch']:
+                if location_info.get(key):
+                    (cfg_section, cfg_key) = location_info[key]
+                    what[key] = self.cfg.get(cfg_section, cfg_key)
+            inputs.append(what)
+        return inputs
+
+    def _configure_inputs(self):
+        inputs = dict()
+        for fn in self._get_config_files():
+            (_, contents) = self._get_source_config(fn)
+            inputs[fn] = {
+                'params': self._get_param_map(fn),
+                'source': contents,
+                'target': self._get_target_config_name(fn),
+            }
+        return {
+            'configs': inputs,
+            'links': self._get_symlinks(),
+        }
+
+    def _install_inputs(self):
+        return {
+            'packages': self._get_packages(),
+            'params': self._get_param_map(None),
+        }
+
+    def phase_inputs(self, phase):
+        if phase == 'download':
+            return self._download_inputs()
+        elif phase == 'configure':
+            return self._configure_inputs()
+        elif phase in ['pre_install', 'install', 'post_install']:
+            return self._install_inputs()
+        return None
+
+    def _get_downloader(self, uri, target_dir, branch):
+        return down.GitDownloader(self.distro, uri, target_dir, branch,
+                                  mirror=down.get_mirror(self.distro, self.cfg),
+                                  depth=down.shallow_depth(self.cfg))
 
     def _get_param_map(self, config_fn):
         return dict()
@@ -198,21 +282,33 @@ class PkgInstallComponent(ComponentBase):
             pkg_names = set([p['name'] for p in pkgs])
             LOG.info("Setting up %s packages (%s)" % (len(pkg_names), ", ".join(pkg_names)))
             with utils.progress_bar(INSTALL_TITLE, len(pkgs)) as p_bar:
-                for (i, p) in enumerate(pkgs):
+                for p in pkgs:
                     self.tracewriter.package_installed(p)
-                    self.packager.install(p)
-                    p_bar.update(i + 1)
+                if not self.packages_batched:
+                    pkg_output_fn = tr.output_fn(self.trace_dir, 'packages')
+                    self.tracewriter.file_touched(pkg_output_fn)
+                    self.packager.install_batch(pkgs, p_bar.update, pkg_output_fn)
         else:
             LOG.info('No packages to install for %s',
                      self.component_name)
         return self.trace_dir
 
-    def pre_install(self):
+    def batch_packages(self):
+        return self._get_packages()
+
+    def batch_pre_install(self):
+        self._pre_install_pkgs()
+
+    def _pre_install_pkgs(self):
         pkgs = self._get_packages()
         if pkgs:
             mp = self._get_param_map(None)
             self.packager.pre_install(pkgs, mp)
 
+    def pre_install(self):
+        if not self.packages_batched:
+            self._pre_install_pkgs()
+
     def post_install(self):
         pkgs = self._get_packages()
         if pkgs:
@@ -257,8 +353,8 @@ class PkgInstallComponent(ComponentBase):
                 LOG.debug("Applying side-effects of param replacement for template %s", source_fn)
                 contents = self._config_adjust(contents, fn)
                 LOG.info("Writing configuration file %s", tgt_fn)
-                self.tracewriter.cfg_file_written(sh.write_file(tgt_fn,
-                                                                contents))
+                status = sh.write_file_if_changed(tgt_fn, contents)
+                self.tracewriter.cfg_file_written(tgt_fn, contents, status)
         return len(configs)
 
     def _configure_symlinks(self):
@@ -298,22 +394,23 @@ class PythonInstallComponent(PkgInstallComponent):
         pip_list = list(self.pips)
         for name in self.desired_subsystems:
             if name in self.subsystem_info:
-                # Todo handle duplicates/version differences?
                 LOG.debug("Extending pip list with pips for subsystem %s" % (name))
                 subsystem_pips = self.subsystem_info[name].get('pips', list())
                 pip_list.extend(subsystem_pips)
-        return pip_list
+        return pip.merge(pip_list)
+
+    def batch_pips(self):
+        return self._get_pips()
 
     def _install_pips(self):
         pips = self._get_pips()
         if pips:
             pip_names = set([p['name'] for p in pips])
             LOG.info("Setting up %s pips (%s)", len(pip_names), ", ".join(pip_names))
-            with utils.progress_bar(INSTALL_TITLE, len(pips)) as p_bar:
-                for (i, p) in enumerate(pips):
-                    self.tracewriter.pip_installed(p)
-                    pip.install(p, self.distro)
-                    p_bar.update(i + 1)
+            for p in pips:
+                self.tracewriter.pip_installed(p)
+            if not self.packages_batched:
+                pip.install_batch(pips, self.distro, pip.get_cache_dir(self.cfg))
 
     def _install_python_setups(self):
         pydirs = self._get_python_directories()
@@ -324,23 +421,35 @@ class PythonInstallComponent(PkgInstallComponent):
                 working_dir = wkdir or self.app_dir
                 self.tracewriter.dirs_made(*sh.mkdirslist(working_dir))
                 self.tracewriter.py_installed(name, working_dir)
-                (stdout, stderr) = sh.execute(*PY_INSTALL,
-                                               cwd=working_dir,
-                                               run_as_root=True)
                 py_trace_name = "%s-%s" % (tr.PY_TRACE, name)
+                py_output_fn = tr.output_fn(self.trace_dir, py_trace_name)
+                self.tracewriter.file_touched(py_output_fn)
+                with pip.INSTALL_LOCK:
+                    sh.execute(*PY_INSTALL,
+                               cwd=working_dir,
+                               run_as_root=True,
+                               output_fn=py_output_fn)
                 py_writer = tr.TraceWriter(tr.trace_fn(self.trace_dir,
                                                        py_trace_name))
                 # Format or json encoding isn't really needed here since this is
                 # more just for information output/lookup if desired.
                 py_writer.trace("CMD", " ".join(PY_INSTALL))
-                py_writer.trace("STDOUT", stdout)
-                py_writer.trace("STDERR", stderr)
+                py_writer.trace("OUTPUT", py_output_fn)
                 self.tracewriter.file_touched(py_writer.filename())
 
     def _python_install(self):
         self._install_pips()
         self._install_python_setups()
 
+    def _install_inputs(self):
+        inputs = PkgInstallComponent._install_inputs(self)
+        inputs['pips'] = self._get_pips()
+        heads = dict()
+        for (name, wkdir) in self._get_python_directories().items():
+            heads[name] = down.git_head(self.distro, wkdir or self.app_dir)
+        inputs['python'] = heads
+        return inputs
+
     def install(self):
         trace_dir = PkgInstallComponent.install(self)
         self._python_install()
@@ -403,13 +512,8 @@ class PkgUninstallComponent(ComponentBase):
             pkg_names = set([p['name'] for p in pkgs])
             LOG.info("Potentially removing %s packages (%s)",
                      len(pkg_names), ", ".join(pkg_names))
-            which_removed = set()
-            with utils.progress_bar(UNINSTALL_TITLE, len(pkgs), reverse=True) as p_bar:
-                for (i, p) in enumerate(pkgs):
-                    if self.packager.remove(p):
-                        which_removed.add(p['name'])
-                    p_bar.update(i + 1)
-            LOG.info("Actually removed %s packages (%s)",
+            which_removed = self.packager.remove_batch(pkgs)
+            LOG.info("Removing %s packages (%s) once all components are uninstalled",
                      len(which_removed), ", ".join(which_removed))
 
     def _uninstall_touched_files(self):
@@ -461,13 +565,16 @@ class PythonUninstallComponent(PkgUninstallComponent):
         if pylisting:
             LOG.info("Uninstalling %s python setups.", len(pylisting))
             for (_, where) in pylisting:
-                sh.execute(*PY_UNINSTALL, cwd=where, run_as_root=True)
+                with pip.INSTALL_LOCK:
+                    sh.execute(*PY_UNINSTALL, cwd=where, run_as_root=True)
 
 
 class ProgramRuntime(ComponentBase):
     def __init__(self, *args, **kargs):
         ComponentBase.__init__(self, *args, **kargs)
-        self.tracewriter = tr.TraceWriter(tr.trace_fn(self.trace_dir, tr.START_TRACE))
+        self.tracewriter = tr.TraceWriter(tr.trace_fn(self.trace_dir, tr.START_TRACE),
+                                          break_if_there=(not self.keep_traces),
+                                          buffered=True)
         self.tracereader = tr.TraceReader(tr.trace_fn(self.trace_dir, tr.START_TRACE))
 
     def _get_apps_to_start(self):
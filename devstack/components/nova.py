@@ -22,6 +22,7 @@ from devstack import exceptions
 from devstack import libvirt as virsh
 from devstack import log as logging
 from devstack import shell as sh
+from devstack import trace as tr
 from devstack import utils
 
 from devstack.components import db
@@ -299,6 +300,12 @@ class NovaInstaller(comp.PythonInstallComponent):
     def _get_config_files(self):
         return list(CONFIGS)
 
+    def phase_inputs(self, phase):
+        if phase == 'configure':
+            # The nova configuration is generated from all over the place
+            return None
+        return comp.PythonInstallComponent.phase_inputs(self, phase)
+
     def _setup_network_initer(self):
         LOG.info("Configuring nova network initializer template %s.", NET_INIT_CONF)
         (_, contents) = utils.load_template(self.component_name, NET_INIT_CONF)
@@ -314,7 +321,9 @@ class NovaInstaller(comp.PythonInstallComponent):
         mp = dict()
         mp['BIN_DIR'] = self.bin_dir
         mp['CFGFILE'] = sh.joinpths(self.cfg_dir, API_CONF)
-        utils.execute_template(*DB_SYNC_CMD, params=mp)
+        sync_output_fn = tr.output_fn(self.trace_dir, 'db-sync')
+        self.tracewriter.file_touched(sync_output_fn)
+        utils.execute_template(*DB_SYNC_CMD, params=mp, output_fn=sync_output_fn)
 
     def post_install(self):
         comp.PythonInstallComponent.post_install(self)
@@ -349,7 +358,8 @@ class NovaInstaller(comp.PythonInstallComponent):
         LOG.info("Writing nova configuration to %s" % (conf_fn))
         LOG.debug(nova_conf_contents)
         self.tracewriter.dirs_made(*sh.mkdirslist(sh.dirname(conf_fn)))
-        self.tracewriter.cfg_file_written(sh.write_file(conf_fn, nova_conf_contents))
+        status = sh.write_file_if_changed(conf_fn, nova_conf_contents)
+        self.tracewriter.cfg_file_written(conf_fn, nova_conf_contents, status)
 
     def _get_source_config(self, config_fn):
         name = config_fn
@@ -389,7 +399,7 @@ class NovaInstaller(comp.PythonInstallComponent):
                 dirs_made = sh.mkdirslist(sh.dirname(fn))
                 sh.write_file(fn, contents)
             self.tracewriter.dirs_made(*dirs_made)
-            self.tracewriter.cfg_file_written(fn)
+            self.tracewriter.cfg_file_written(fn, contents)
             configs_made += 1
         return configs_made
 
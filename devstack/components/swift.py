@@ -141,30 +141,45 @@ class SwiftInstaller(comp.PythonInstallComponent):
         sh.mount_loopback_file(self.fs_image, self.fs_dev, FS_TYPE)
         sh.chown_r(self.fs_dev, sh.geteuid(), sh.getegid())
 
-    def _create_node_config(self, node_number, port):
+    def _load_node_sources(self):
+        # Generated by us (not shipped templates) and the same for each
+        # node so only read once (they are empty when doing a dry-run)
+        sources = dict()
+        for t in ['object', 'container', 'account']:
+            sources[t] = sh.load_file(sh.joinpths(self.cfg_dir, '%s-server.conf' % t))
+        return sources
+
+    def _create_node_config(self, node_number, port, sources):
         for t in ['object', 'container', 'account']:
-            src_fn = sh.joinpths(self.cfg_dir, '%s-server.conf' % t)
             tgt_fn = sh.joinpths(self.cfg_dir, '%s-server/%d.conf' % (t, node_number))
             adjustments = {
                            '%NODE_PATH%': sh.joinpths(self.datadir, str(node_number)),
                            '%BIND_PORT%': str(port),
                            '%LOG_FACILITY%': str(2 + node_number),
                           }
-            sh.copy_replace_file(src_fn, tgt_fn, adjustments)
+            contents = sources[t]
+            for (k, v) in adjustments.items():
+                contents = contents.replace(k, v)
+            self.tracewriter.dirs_made(*sh.mkdirslist(sh.dirname(tgt_fn)))
+            status = sh.write_file_if_changed(tgt_fn, contents)
+            self.tracewriter.cfg_file_written(tgt_fn, contents, status)
             port += 1
 
     def _delete_templates(self):
         for t in ['object', 'container', 'account']:
-            sh.unlink(sh.joinpths(self.cfg_dir, '%s-server.conf' % t))
+            fn = sh.joinpths(self.cfg_dir, '%s-server.conf' % t)
+            sh.unlink(fn)
+            self.tracewriter.file_removed(fn)
 
     def _create_nodes(self):
+        sources = self._load_node_sources()
         for i in range(1, 5):
             self.tracewriter.dirs_made(sh.mkdirslist(sh.joinpths(self.fs_dev, '%d/node' % i)))
             link_tgt = sh.joinpths(self.datadir, str(i))
             sh.symlink(sh.joinpths(self.fs_dev, str(i)), link_tgt)
             self.tracewriter.symlink_made(link_tgt)
             start_port = (6010 + (i - 1) * 5)
-            self._create_node_config(i, start_port)
+            self._create_node_config(i, start_port, sources)
         self._delete_templates()
 
     def _turn_on_rsync(self):
@@ -178,12 +193,12 @@ class SwiftInstaller(comp.PythonInstallComponent):
         self.tracewriter.symlink_made(SWIFT_RSYNC_LOC)
 
     def _setup_binaries(self):
-        sh.move(sh.joinpths(self.cfg_dir, SWIFT_MAKERINGS), self.makerings_file)
-        sh.chmod(self.makerings_file, 0777)
-        self.tracewriter.file_touched(self.makerings_file)
-        sh.move(sh.joinpths(self.cfg_dir, SWIFT_STARTMAIN), self.startmain_file)
-        sh.chmod(self.startmain_file, 0777)
-        self.tracewriter.file_touched(self.startmain_file)
+        for (name, tgt_fn) in [(SWIFT_MAKERINGS, self.makerings_file), (SWIFT_STARTMAIN, self.startmain_file)]:
+            src_fn = sh.joinpths(self.cfg_dir, name)
+            sh.move(src_fn, tgt_fn)
+            sh.chmod(tgt_fn, 0777)
+            self.tracewriter.file_removed(src_fn)
+            self.tracewriter.file_touched(tgt_fn)
 
     def _make_rings(self):
         sh.execute(self.makerings_file, run_as_root=True)
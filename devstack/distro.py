@@ -111,6 +111,28 @@ class Distro(object):
     def known_component(self, name):
         return name in self._components
 
+    def resolve_component_dependencies(self, components):
+        """Returns a map of each named component (and what they need) to its dependencies."""
+        all_components = dict()
+        active_names = [(c, None) for c in components]
+        while active_names:
+            (component, parent) = active_names.pop()
+            try:
+                component_details = self._components[component]
+            except KeyError:
+                if parent:
+                    raise RuntimeError('Could not find details about component %r, a dependency of %r, for %s' %
+                                       (component, parent, self.name))
+                else:
+                    raise RuntimeError('Could not find details about component %r for %s' %
+                                       (component, self.name))
+            deps = set(component_details.get('dependencies') or list())
+            all_components[component] = deps
+            for d in deps:
+                if d not in all_components:
+                    active_names.append((d, component))
+        return all_components
+
     def supports_distro(self, distro_name):
         """Does this distro support the named Linux distro?
 
@@ -130,7 +152,7 @@ class Distro(object):
             entry_point = component_info[action]
             cls = importer.import_entry_point(entry_point)
             # Knock all action class info (and any other keys)
-            key_deletions = [action] + settings.ACTIONS
+            key_deletions = [action, 'dependencies'] + settings.ACTIONS
             for k in key_deletions:
                 if k in component_info:
                     del component_info[k]
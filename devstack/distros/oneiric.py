@@ -50,6 +50,8 @@ class AptPackager(apt.AptPackager):
 
     def _remove_special(self, name, info):
         if name == 'rabbitmq-server':
+            if self._is_installed(info):
+                return True
             #https://bugs.launchpad.net/ubuntu/+source/rabbitmq-server/+bug/878597
             #https://bugs.launchpad.net/ubuntu/+source/rabbitmq-server/+bug/878600
             LOG.debug("Handling special remove of %s." % (name))
@@ -96,9 +96,10 @@ class YumPackager(yum.YumPackager):
 
     def _install_special(self, name, info):
         if name in RHEL_RELINKS:
-            full_pkg_name = self._format_pkg_name(name, info.get("version"))
-            install_cmd = yum.YUM_INSTALL + [full_pkg_name]
-            self._execute_yum(install_cmd)
+            if not self._is_installed(info):
+                full_pkg_name = self._format_pkg_name(name, info.get("version"))
+                install_cmd = yum.YUM_INSTALL + [full_pkg_name]
+                self._execute_yum(install_cmd)
             (src, tgt) = RHEL_RELINKS.get(name)
             if not sh.islink(tgt):
                 # This is actually a feature, EPEL must not conflict with RHEL, so X pkg installs newer version in parallel.
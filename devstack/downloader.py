@@ -14,11 +14,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-
+import hashlib
+import re
+import threading
+import time
 import urllib
 
 import progressbar
 
+from devstack import exceptions as excp
 from devstack import log as logging
 from devstack import shell as sh
 
@@ -27,6 +31,56 @@ LOG = logging.getLogger("devstack.downloader")
 # Git master branch
 GIT_MASTER_BRANCH = "master"
 
+# What the remote repository is known as in our checkouts
+GIT_REMOTE = "origin"
+
+# Revisions that look like these are (abbreviated) commit shas
+GIT_SHA_MATCHER = re.compile(r"^[0-9a-f]{7,40}$")
+
+# How long (in seconds) a git mirror is used before it is fetched again
+MIRROR_TTL = 3600
+
+# Touched each time a git mirror is fetched (so we know when that was)
+MIRROR_STAMP_FN = "devstack-fetched"
+
+# Only one thing should be creating or fetching a given mirror at a time
+_MIRROR_LOCKS = dict()
+_MIRROR_LOCKS_LOCK = threading.Lock()
+
+
+def max_workers(cfg):
+    """How many downloads can be active at once (as configured)."""
+    return max(1, int(cfg.getdefaulted('git', 'download_workers', 1)))
+
+
+def get_mirror(distro, cfg):
+    """Returns the git mirror store (as configured) or none if not enabled."""
+    mirror_dir = cfg.getdefaulted('git', 'mirror_dir', '')
+    if not mirror_dir:
+        return None
+    ttl = int(cfg.getdefaulted('git', 'mirror_ttl', MIRROR_TTL))
+    return GitMirror(distro, mirror_dir, ttl)
+
+
+def shallow_depth(cfg):
+    """How deep clones of named revisions should be (zero for a full clone)."""
+    return max(0, int(cfg.getdefaulted('git', 'shallow_depth', 0)))
+
+
+def git_commit(distro, where, revision):
+    """Returns the commit the revision is at in the checkout (or none if unknown there)."""
+    if not sh.isdir(where):
+        return None
+    cmd = list(distro.get_command('git', 'rev-parse'))
+    cmd += ['--verify', '-q', "%s^{commit}" % (revision)]
+    (stdout, _) = sh.execute(*cmd, cwd=where, check_exit_code=False)
+    return stdout.strip() or None
+
+
+def git_head(distro, where):
+    """Returns the commit the git checkout at where is at (or none if not a checkout)."""
+    return git_commit(distro, where, 'HEAD')
+
 
 class Downloader(object):
 
@@ -38,36 +92,226 @@ class Downloader(object):
         raise NotImplementedError()
 
 
+class GitMirror(object):
+    """
+    Keeps a bare mirror of each git uri in a local directory (fetching it
+    again once it is older than a given ttl) so that checkouts can be cloned
+    from local disk instead of over the network.
+    """
+
+    def __init__(self, distro, mirror_dir, ttl=MIRROR_TTL):
+        self.distro = distro
+        self.mirror_dir = mirror_dir
+        self.ttl = ttl
+
+    def _mirror_path(self, uri):
+        name = uri.rstrip("/").split("/")[-1]
+        if name.endswith(".git"):
+            name = name[0:-len(".git")]
+        name = "%s-%s.git" % (name, hashlib.md5(uri).hexdigest()[0:8])
+        return sh.joinpths(self.mirror_dir, name)
+
+    def _get_lock(self, path):
+        with _MIRROR_LOCKS_LOCK:
+            if path not in _MIRROR_LOCKS:
+                _MIRROR_LOCKS[path] = threading.Lock()
+            return _MIRROR_LOCKS[path]
+
+    def _is_stale(self, path):
+        stamp_fn = sh.joinpths(path, MIRROR_STAMP_FN)
+        if not sh.isfile(stamp_fn):
+            return True
+        return (time.time() - sh.getmtime(stamp_fn)) > self.ttl
+
+    def _mark_fetched(self, path):
+        sh.write_file(sh.joinpths(path, MIRROR_STAMP_FN), "%s" % (time.time()), quiet=True)
+
+    def update(self, uri):
+        """Returns where the (recently fetched) mirror of the given uri is."""
+        path = self._mirror_path(uri)
+        with self._get_lock(path):
+            if not sh.isdir(path):
+                LOG.info("Mirroring using git: %r to %r" % (uri, path))
+                sh.mkdirslist(self.mirror_dir)
+                cmd = list(self.distro.get_command('git', 'clone'))
+                cmd += ['--mirror', uri, path]
+                sh.execute(*cmd)
+                self._mark_fetched(path)
+            elif self._is_stale(path):
+                LOG.info("Refreshing git mirror: located at %r" % (path))
+                cmd = list(self.distro.get_command('git', 'fetch'))
+                cmd += ['--prune']
+                try:
+                    sh.execute(*cmd, cwd=path)
+                    self._mark_fetched(path)
+                except excp.ProcessExecutionError as e:
+                    LOG.warn("Unable to refresh git mirror at %r, using it as is: %s" % (path, e))
+        return path
+
+
 class GitDownloader(Downloader):
 
-    def __init__(self, distro, uri, store_where, branch):
+    def __init__(self, distro, uri, store_where, branch, mirror=None, depth=0):
         Downloader.__init__(self, uri, store_where)
         self.branch = branch
         self.distro = distro
+        self.mirror = mirror
+        self.depth = depth
+
+    def _git(self, name, *args):
+        cmd = list(self.distro.get_command('git', name))
+        cmd += list(args)
+        return sh.execute(*cmd, cwd=self.store_where)
+
+    def _commit(self, revision):
+        return git_commit(self.distro, self.store_where, revision)
+
+    def _fetch(self, *refspecs):
+        # No depth here (only the first clone is shallow), fetching with a
+        # depth would cut the history at a new place which leaves whatever
+        # we merge next with nothing in common with our checkout
+        self._git('fetch', *([GIT_REMOTE] + list(refspecs)))
+
+    def _has_commit(self, revision):
+        # Names win over shas so a (local) branch named like one is not it
+        for ref in ["refs/heads/%s" % (revision), "refs/remotes/%s/%s" % (GIT_REMOTE, revision)]:
+            if self._commit(ref):
+                return False
+        try:
+            self._git('cat-file', '-e', "%s^{commit}" % (revision))
+            return True
+        except excp.ProcessExecutionError:
+            return False
+
+    def _fetch_ref(self, revision):
+        # The refspecs are given explicitly since a shallow clone only
+        # fetches the branch it was cloned at by default
+        refs = [
+            ("refs/heads/%s" % (revision), "refs/remotes/%s/%s" % (GIT_REMOTE, revision)),
+            ("refs/tags/%s" % (revision), "refs/tags/%s" % (revision)),
+        ]
+        for (remote_ref, local_ref) in refs:
+            try:
+                self._fetch("+%s:%s" % (remote_ref, local_ref))
+                return local_ref
+            except excp.ProcessExecutionError:
+                pass
+        return None
+
+    def _update(self, revision):
+        head = self._commit('HEAD')
+        tag = "refs/tags/%s" % (revision)
+        if self._commit(tag):
+            # A tag that we already have does not need fetching
+            if head == self._commit(tag):
+                LOG.info("Git checkout at %r is already at %r" % (self.store_where, revision))
+                return
+            self._git('checkout', tag)
+            return
+        if GIT_SHA_MATCHER.match(revision) and self._has_commit(revision):
+            # A fixed revision that we already have does not need fetching
+            if head == self._commit(revision):
+                LOG.info("Git checkout at %r is already at %r" % (self.store_where, revision))
+                return
+            self._git('checkout', revision)
+            return
+        # Names are looked for (on the remote) before shas that we don't
+        # have since a branch can be named like a sha (ie 'deadbeef')
+        LOG.info("Updating using git: located at %r" % (self.store_where))
+        ref = self._fetch_ref(revision)
+        if ref is None:
+            if not GIT_SHA_MATCHER.match(revision):
+                msg = "No branch or tag named %r found at %s" % (revision, self.uri)
+                raise excp.DownloadException(msg)
+            LOG.info("Fetching using git: %r is not in %r" % (revision, self.store_where))
+            self._fetch("+refs/heads/*:refs/remotes/%s/*" % (GIT_REMOTE))
+            if head == self._commit(revision):
+                LOG.info("Git checkout at %r is already at %r" % (self.store_where, revision))
+                return
+            self._git('checkout', revision)
+            return
+        if head == self._commit(ref):
+            LOG.info("Git checkout at %r is already at %r" % (self.store_where, ref))
+            return
+        if ref.startswith("refs/tags/"):
+            self._git('checkout', ref)
+        elif self._commit("refs/heads/%s" % (revision)):
+            self._git('checkout', revision)
+            self._git('merge', ref)
+        else:
+            # Created from what was fetched (a name like a sha would
+            # otherwise be checked out as that commit)
+            self._git('checkout', '-b', revision, ref)
 
     def download(self):
         dirsmade = list()
+        revision = self.branch or GIT_MASTER_BRANCH
         if sh.isdir(self.store_where):
-            LOG.info("Updating using git: located at %r" % (self.store_where))
-            cmd = list(self.distro.get_command('git', 'checkout'))
-            cmd += [GIT_MASTER_BRANCH]
-            sh.execute(*cmd, cwd=self.store_where)
-            cmd = self.distro.get_command('git', 'pull')
+            self._update(revision)
+            return dirsmade
+        elif self.mirror:
+            source = self.mirror.update(self.uri)
+            LOG.info("Downloading using git: %r (mirrored at %r) to %r" % (self.uri, source, self.store_where))
+            dirsmade.extend(sh.mkdirslist(self.store_where))
+            cmd = list(self.distro.get_command('git', 'clone'))
+            cmd += [source, self.store_where]
+            sh.execute(*cmd)
+            # Later updates should go to the real repository
+            cmd = list(self.distro.get_command('git', 'remote'))
+            cmd += ['set-url', 'origin', self.uri]
             sh.execute(*cmd, cwd=self.store_where)
+        elif self.depth and not GIT_SHA_MATCHER.match(revision):
+            LOG.info("Downloading using git: %r (at %r with depth %s) to %r" % (self.uri, revision, self.depth, self.store_where))
+            dirsmade.extend(sh.mkdirslist(self.store_where))
+            cmd = list(self.distro.get_command('git', 'clone'))
+            cmd += ['--depth', str(self.depth), '--branch', revision, self.uri, self.store_where]
+            sh.execute(*cmd)
+            return dirsmade
         else:
             LOG.info("Downloading using git: %r to %r" % (self.uri, self.store_where))
             dirsmade.extend(sh.mkdirslist(self.store_where))
             cmd = list(self.distro.get_command('git', 'clone'))
             cmd += [self.uri, self.store_where]
             sh.execute(*cmd)
-        if self.branch and self.branch != GIT_MASTER_BRANCH:
-            LOG.info("Adjusting branch using git: %r" % (self.branch))
-            cmd = list(self.distro.get_command('git', 'checkout'))
-            cmd += [self.branch]
-            sh.execute(*cmd, cwd=self.store_where)
+        if revision != GIT_MASTER_BRANCH:
+            LOG.info("Adjusting branch using git: %r" % (revision))
+            self._git('checkout', revision)
         return dirsmade
 
 
+class DownloadManager(object):
+    """
+    Bounds how many downloads are active at once. One manager is shared by
+    everything that downloads for a persona (the callers are what run at the
+    same time and each download waits for a free slot before it starts). A
+    failed download does not stop the others given to the same run, instead
+    those failures are collected and raised together once they have finished.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers)
+        self.slots = threading.BoundedSemaphore(self.max_workers)
+
+    def run(self, downloads):
+        # Each download is a (name, downloader, on done callback) tuple, the
+        # on done callback gets called with what the download returned
+        failures = list()
+        for (name, downloader, on_done) in downloads:
+            try:
+                with self.slots:
+                    result = downloader.download()
+            except Exception as e:
+                LOG.error("Downloading %s failed: %s" % (name, e))
+                failures.append((name, e))
+                continue
+            if on_done:
+                on_done(result)
+        if failures:
+            msg = "Failed downloading (%s)" % (", ".join(["%s: %s" % (name, e) for (name, e) in failures]))
+            raise excp.DownloadException(msg)
+        return len(downloads)
+
+
 class UrlLibDownloader(Downloader):
 
     def __init__(self, uri, store_where, **kargs):
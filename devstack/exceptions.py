@@ -39,6 +39,10 @@ class BadParamException(StackException):
     pass
 
 
+class DownloadException(StackException):
+    pass
+
+
 class NoTraceException(StackException):
     pass
 
@@ -75,6 +79,10 @@ class ConfigException(StackException):
     pass
 
 
+class DriftException(StackException):
+    pass
+
+
 class ProcessExecutionError(IOError):
     def __init__(self, stdout=None, stderr=None,
                  exit_code=None, cmd=None,
@@ -43,6 +43,13 @@ def parse():
         dest="verbosity",
         default=[1],
         help="increase the verbose level")
+    parser.add_option("--timeline",
+        action="store",
+        type="string",
+        dest="timeline_fn",
+        metavar="FILE",
+        help=("write how long each component phase and command took to FILE"
+              " (as chrome trace event json, see chrome://tracing)"))
     parser.add_option("--dryrun",
         action="store_true",
         dest="dryrun",
@@ -78,6 +85,32 @@ def parse():
                           default=True,
                           help="do not prompt the user for passwords",
                           )
+    base_group.add_option("--parallel",
+        action="store",
+        type="int",
+        dest="parallel",
+        default=1,
+        metavar="N",
+        help=("run up to N components (whose dependencies are satisfied) at the same time,"
+              " 1 runs them one after another (default: %default)"))
+    base_group.add_option("--resume",
+        action="store_true",
+        dest="resume",
+        default=False,
+        help=("skip the component phases that a previous (failed) run of ACTION"
+              " already completed (default: %default)"))
+    base_group.add_option("--converge",
+        action="store_true",
+        dest="converge",
+        default=False,
+        help=("skip the component phases whose inputs have not changed since"
+              " they last completed (default: %default)"))
+    base_group.add_option("--no-config-cache",
+        action="store_false",
+        dest="config_cache",
+        default=True,
+        help=("resolve the configuration again instead of using what a previous"
+              " run resolved (and cached) in the root directory"))
     parser.add_option_group(base_group)
 
     # Uninstall and stop options
@@ -109,5 +142,10 @@ def parse():
     output['persona_fn'] = options.persona_fn
     output['verbosity'] = len(options.verbosity)
     output['prompt_for_passwords'] = options.prompt_for_passwords
+    output['parallel'] = options.parallel
+    output['resume'] = options.resume
+    output['config_cache'] = options.config_cache
+    output['converge'] = options.converge
+    output['timeline_fn'] = options.timeline_fn
 
     return output
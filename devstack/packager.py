@@ -14,12 +14,57 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import fnmatch
+import threading
+
 from devstack import decorators
+from devstack import exceptions as excp
 from devstack import log as logging
 from devstack import utils
 
 LOG = logging.getLogger("devstack.packager")
 
+# Package managers hold a system wide lock while running so only one
+# package command can be active at a time (even across components)
+PKG_LOCK = threading.RLock()
+
+# How many packages we ask the package manager to install in one transaction
+MAX_BATCH = 64
+
+
+def _specificity(version):
+    return len(str(version).replace("*", ""))
+
+
+def merge(pkgs):
+    """
+    Returns the given packages with the duplicate names merged into one
+    package using the most specific version asked for (ie 0.6.8* over 0.6*),
+    versions that do not agree with that one (ie 0.6* and 0.7*) are a
+    conflict.
+    """
+    merged = dict()
+    versions = dict()
+    names = list()
+    for pkg in pkgs:
+        name = pkg['name']
+        if name not in merged:
+            merged[name] = dict(pkg)
+            versions[name] = list()
+            names.append(name)
+        if pkg.get('version'):
+            versions[name].append(str(pkg['version']))
+    for name in names:
+        if not versions[name]:
+            continue
+        wanted = sorted(versions[name], key=_specificity)[-1]
+        for version in versions[name]:
+            if not fnmatch.fnmatch(wanted, version):
+                msg = "Conflicting versions (%s, %s) requested for package %s" % (version, wanted, name)
+                raise excp.DependencyException(msg)
+        merged[name]['version'] = wanted
+    return [merged[name] for name in names]
+
 
 class Packager(object):
 
@@ -27,15 +72,140 @@ class Packager(object):
     def __init__(self, distro, keep_packages):
         self.distro = distro
         self.keep_packages = keep_packages
+        # Package name -> installed version (read in when first needed)
+        self.installed = None
+        # How many packages we didn't install since they already were
+        self.skipped = 0
+        # Names of the packages we installed during this run
+        self.installed_now = set()
+        # Packages to remove (all at once) when finished
+        self.pending_removals = list()
 
     def install(self, pkg):
-        raise NotImplementedError()
+        self.install_batch([pkg])
+
+    def _get_installed(self):
+        if self.installed is None:
+            self.installed = dict()
+            try:
+                self.installed.update(self._load_installed())
+            except excp.ProcessExecutionError as e:
+                LOG.warn("Unable to determine which packages are already installed: %s" % (e))
+            LOG.debug("Found %s packages already installed." % (len(self.installed)))
+        return self.installed
+
+    def _is_installed(self, pkg):
+        installed = self._get_installed()
+        name = pkg['name']
+        if name not in installed:
+            return False
+        version = pkg.get('version')
+        if not version:
+            return True
+        # Versions are either exact or a glob (ie 5.1*)
+        have = installed[name]
+        if have is None:
+            return False
+        return have == version or fnmatch.fnmatch(have, version)
+
+    def install_batch(self, pkgs, progress_cb=None, output_fn=None):
+        """
+        Installs the given packages using as few package manager transactions
+        as possible, packages that need special handling are still installed
+        by themselves. The progress callback (if any) is called with the
+        number of packages that have been handled so far and the output of
+        the transactions is streamed into the output file (if any).
+        """
+        pkgs = merge(pkgs)
+        with PKG_LOCK:
+            installed = self._get_installed()
+            batch = list()
+            skipped = 0
+            done = 0
+            for pkg in pkgs:
+                already = self._is_installed(pkg)
+                if self._install_special(pkg['name'], pkg):
+                    # Always asked since they may do more than install the
+                    # package (ie make links), they skip what is installed
+                    if not already:
+                        installed[pkg['name']] = pkg.get('version')
+                        self.installed_now.add(pkg['name'])
+                    elif pkg['name'] not in self.installed_now:
+                        skipped += 1
+                    done += 1
+                elif already:
+                    if pkg['name'] not in self.installed_now:
+                        skipped += 1
+                    done += 1
+                else:
+                    batch.append(pkg)
+                if progress_cb:
+                    progress_cb(done)
+            if skipped:
+                LOG.info("Skipped %s packages that are already installed." % (skipped))
+                self.skipped += skipped
+            for i in range(0, len(batch), MAX_BATCH):
+                chunk = batch[i:i + MAX_BATCH]
+                LOG.debug("Installing %s packages in one transaction." % (len(chunk)))
+                self._install_many(chunk, output_fn)
+                # We only know the version we asked for (which may be a glob)
+                for pkg in chunk:
+                    installed[pkg['name']] = pkg.get('version')
+                    self.installed_now.add(pkg['name'])
+                done += len(chunk)
+                if progress_cb:
+                    progress_cb(done)
 
     def remove(self, pkg):
         if self.keep_packages:
             return False
-        else:
-            return self._remove(pkg)
+        with PKG_LOCK:
+            removed = self._remove(pkg)
+            if removed and self.installed is not None:
+                self.installed.pop(pkg['name'], None)
+            return removed
+
+    def remove_batch(self, pkgs):
+        """
+        Queues the given packages to be removed (in a single package manager
+        transaction with the packages of every other component) by finish(),
+        packages that are not removable are skipped and packages that need
+        special handling are still removed by themselves (right away). Returns
+        the names of the packages that were (or will be) removed.
+        """
+        if self.keep_packages:
+            return list()
+        with PKG_LOCK:
+            removed = list()
+            queued = set([pkg['name'] for pkg in self.pending_removals])
+            for pkg in pkgs:
+                if not pkg.get('removable', True):
+                    continue
+                name = pkg['name']
+                if name in removed:
+                    continue
+                if name not in queued and not self._remove_special(name, pkg):
+                    self.pending_removals.append(pkg)
+                    queued.add(name)
+                removed.append(name)
+            return removed
+
+    def _remove_pending(self):
+        with PKG_LOCK:
+            batch = self.pending_removals
+            self.pending_removals = list()
+            if batch:
+                LOG.info("Removing %s packages in one transaction." % (len(batch)))
+                self._remove_many(batch)
+                if self.installed is not None:
+                    for pkg in batch:
+                        self.installed.pop(pkg['name'], None)
+
+    def finish(self):
+        # Called once an action has finished with the package manager
+        self._remove_pending()
+        if self.skipped:
+            LOG.info("Skipped installing %s packages that were already installed." % (self.skipped))
 
     def pre_install(self, pkgs, params=None):
         for info in pkgs:
@@ -55,3 +225,21 @@ class Packager(object):
 
     def _remove(self, pkg):
         raise NotImplementedError()
+
+    def _load_installed(self):
+        raise NotImplementedError()
+
+    def _install_many(self, pkgs, output_fn=None):
+        raise NotImplementedError()
+
+    def _remove_many(self, pkgs):
+        raise NotImplementedError()
+
+    def _install_special(self, name, info):
+        return False
+
+    def _remove_special(self, name, info):
+        return False
+
+    def _format_pkg_name(self, name, version):
+        raise NotImplementedError()
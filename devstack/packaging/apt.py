@@ -28,6 +28,10 @@ APT_REMOVE = ["remove", "-y"]
 APT_INSTALL = ["install", "-y"]
 APT_AUTOREMOVE = ['autoremove', '-y']
 
+# Lists the known packages (with their versions and status)
+DPKG_QUERY = ['dpkg-query', '-W', '-f=${Status}\t${Package}\t${Version}\n']
+DPKG_INSTALLED = 'install ok installed'
+
 # Should we use remove or purge?
 APT_DO_REMOVE = APT_PURGE
 
@@ -43,6 +47,8 @@ class AptPackager(pack.Packager):
     def __init__(self, distro, keep_packages):
         pack.Packager.__init__(self, distro, keep_packages)
         self.auto_remove = True
+        # Batched removals leave the autoremove until we are finished
+        self.needs_auto_remove = False
 
     def _format_pkg_name(self, name, version):
         if version:
@@ -52,10 +58,11 @@ class AptPackager(pack.Packager):
 
     def _execute_apt(self, cmd, **kargs):
         full_cmd = APT_GET + cmd
-        return sh.execute(*full_cmd, run_as_root=True,
-            check_exit_code=True,
-            env_overrides=ENV_ADDITIONS,
-            **kargs)
+        with pack.PKG_LOCK:
+            return sh.execute(*full_cmd, run_as_root=True,
+                check_exit_code=True,
+                env_overrides=ENV_ADDITIONS,
+                **kargs)
 
     def _remove(self, pkg):
         removable = pkg.get('removable', True)
@@ -71,14 +78,29 @@ class AptPackager(pack.Packager):
             self._execute_apt(APT_AUTOREMOVE)
         return True
 
-    def install(self, pkg):
-        name = pkg['name']
-        if self._install_special(name, pkg):
-            return
-        else:
-            pkg_full = self._format_pkg_name(name, pkg.get("version"))
-            cmd = APT_INSTALL + [pkg_full]
-            self._execute_apt(cmd)
+    def _install_many(self, pkgs, output_fn=None):
+        cmd = APT_INSTALL + [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        self._execute_apt(cmd, output_fn=output_fn)
+
+    def _remove_many(self, pkgs):
+        cmd = APT_DO_REMOVE + [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        self._execute_apt(cmd)
+        self.needs_auto_remove = True
+
+    def finish(self):
+        pack.Packager.finish(self)
+        if self.auto_remove and self.needs_auto_remove:
+            self._execute_apt(APT_AUTOREMOVE)
+        self.needs_auto_remove = False
+
+    def _load_installed(self):
+        (stdout, _) = sh.execute(*DPKG_QUERY, check_exit_code=True)
+        installed = dict()
+        for line in stdout.splitlines():
+            pieces = line.split("\t")
+            if len(pieces) == 3 and pieces[0] == DPKG_INSTALLED:
+                installed[pieces[1]] = pieces[2]
+        return installed
 
     def _remove_special(self, name, info):
         return False
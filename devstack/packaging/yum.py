@@ -27,6 +27,9 @@ YUM_CMD = ['yum']
 YUM_INSTALL = ["install", "-y", "-t"]
 YUM_REMOVE = ['erase', '-y', "-t"]
 
+# Lists the installed packages (with their versions)
+RPM_QUERY = ['rpm', '-qa', '--qf', '%{NAME}\t%{VERSION}-%{RELEASE}\n']
+
 # Yum separates its pkg names and versions with a dash
 VERSION_TEMPL = "%s-%s"
 
@@ -43,9 +46,10 @@ class YumPackager(pack.Packager):
 
     def _execute_yum(self, cmd, **kargs):
         full_cmd = YUM_CMD + cmd
-        return sh.execute(*full_cmd, run_as_root=True,
-            check_exit_code=True,
-            **kargs)
+        with pack.PKG_LOCK:
+            return sh.execute(*full_cmd, run_as_root=True,
+                check_exit_code=True,
+                **kargs)
 
     def _remove_special(self, name, info):
         return False
@@ -53,14 +57,22 @@ class YumPackager(pack.Packager):
     def _install_special(self, name, info):
         return False
 
-    def install(self, pkg):
-        name = pkg['name']
-        if self._install_special(name, pkg):
-            return
-        else:
-            pkg_full = self._format_pkg_name(name, pkg.get("version"))
-            cmd = YUM_INSTALL + [pkg_full]
-            self._execute_yum(cmd)
+    def _load_installed(self):
+        (stdout, _) = sh.execute(*RPM_QUERY, check_exit_code=True)
+        installed = dict()
+        for line in stdout.splitlines():
+            pieces = line.split("\t")
+            if len(pieces) == 2:
+                installed[pieces[0]] = pieces[1]
+        return installed
+
+    def _install_many(self, pkgs, output_fn=None):
+        cmd = YUM_INSTALL + [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        self._execute_yum(cmd, output_fn=output_fn)
+
+    def _remove_many(self, pkgs):
+        cmd = YUM_REMOVE + [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        self._execute_yum(cmd)
 
     def _remove(self, pkg):
         removable = pkg.get('removable', True)
@@ -14,14 +14,30 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+
+import pkg_resources
 
 from devstack import exceptions as excp
 from devstack import log as logging
 from devstack import shell as sh
+from devstack import utils
 
 LOG = logging.getLogger("devstack.pip")
 PIP_UNINSTALL_CMD_OPTS = ['-y', '-q']
 PIP_INSTALL_CMD_OPTS = ['-q']
+PIP_REQUIRES_FN = 'pip-requires.txt'
+
+# Used to fill (and then only install from) a local artifact cache
+PIP_WHEEL_CMD_OPTS = ['-q', '--wheel-dir']
+PIP_CACHED_CMD_OPTS = ['--no-index', '--find-links']
+
+# Options that only mean something when installing (pip wheel rejects them)
+PIP_INSTALL_ONLY_OPTS = ['-U', '--upgrade']
+
+# Pip (and setup.py develop) adjust the same site-packages files so
+# only one of them should be adjusting those files at a time
+INSTALL_LOCK = threading.RLock()
 
 
 def _make_pip_name(name, version):
@@ -41,7 +57,131 @@ def install(pip, distro):
         LOG.debug("Using pip options: %s" % (options))
         real_cmd += [str(options)]
     real_cmd += [name_full]
-    sh.execute(*real_cmd, run_as_root=True)
+    with INSTALL_LOCK:
+        sh.execute(*real_cmd, run_as_root=True)
+
+
+def same_version(version, other):
+    """Are the two versions the same once normalized (ie 1.5 and 1.5.0 are)?"""
+    return pkg_resources.parse_version(str(version)) == pkg_resources.parse_version(str(other))
+
+
+def merge(pips):
+    """
+    Returns the given pips with the duplicate names merged into one pip, a
+    pip without a version defers to the one that has a version but two
+    different versions of the same pip are a conflict.
+    """
+    merged = dict()
+    names = list()
+    for pip in pips:
+        name = pip['name']
+        if name not in merged:
+            merged[name] = dict(pip)
+            names.append(name)
+            continue
+        have = merged[name]
+        version = pip.get('version')
+        if version is not None:
+            if have.get('version') is None:
+                have['version'] = version
+            elif not same_version(have['version'], version):
+                msg = "Conflicting versions (%s, %s) requested for python package %s" % (have['version'], version, name)
+                raise excp.DependencyException(msg)
+        if pip.get('options') and not have.get('options'):
+            have['options'] = pip['options']
+    return [merged[name] for name in names]
+
+
+def merge_all(wanted):
+    """
+    Merges the pips wanted by many components (a list of (component, pips))
+    into one list, every conflicting version (and who asked for it) is
+    reported at once.
+    """
+    requested = dict()
+    pips = list()
+    for (who, who_pips) in wanted:
+        for pip in who_pips:
+            requested.setdefault(pip['name'], list()).append((who, pip.get('version')))
+            pips.append(pip)
+    conflicts = list()
+    for name in sorted(requested.keys()):
+        versions = [v for (_, v) in requested[name] if v is not None]
+        if [v for v in versions if not same_version(versions[0], v)]:
+            wants = ["%s wants %s" % (who, v) for (who, v) in requested[name] if v is not None]
+            conflicts.append("%s (%s)" % (name, ", ".join(wants)))
+    if conflicts:
+        msg = "Conflicting versions requested for python packages: %s" % ("; ".join(conflicts))
+        raise excp.DependencyException(msg)
+    return merge(pips)
+
+
+def get_cache_dir(cfg):
+    cache_dir = cfg.getdefaulted('pip', 'cache_dir', '')
+    if not cache_dir:
+        return None
+    # Not traced, the cache should outlive uninstalls
+    sh.mkdirslist(cache_dir)
+    return cache_dir
+
+
+def _install_cached(root_cmd, options, requires_fn, cache_dir):
+    cached_cmd = [root_cmd, 'install'] + PIP_INSTALL_CMD_OPTS + PIP_CACHED_CMD_OPTS + [cache_dir]
+    cached_cmd += options
+    cached_cmd += ['-r', requires_fn]
+    try:
+        sh.execute(*cached_cmd, run_as_root=True)
+        return True
+    except excp.ProcessExecutionError:
+        LOG.debug("Not everything needed is in the pip cache at %s, filling it." % (cache_dir))
+    wheel_cmd = [root_cmd, 'wheel'] + PIP_WHEEL_CMD_OPTS + [cache_dir]
+    wheel_cmd += [o for o in options if o not in PIP_INSTALL_ONLY_OPTS]
+    wheel_cmd += ['-r', requires_fn]
+    try:
+        sh.execute(*wheel_cmd, run_as_root=True)
+    except excp.ProcessExecutionError as e:
+        LOG.warn("Unable to fill the pip cache at %s: %s" % (cache_dir, e))
+        return False
+    sh.execute(*cached_cmd, run_as_root=True)
+    return True
+
+
+def install_batch(pips, distro, cache_dir=None):
+    """
+    Installs the given pips using one pip command for each distinct set of
+    pip options (typically just one) by writing them to a requirements file,
+    so that options (ie --upgrade) only apply to the pips that asked for them.
+    When a cache directory is given the pips are installed from the wheels
+    in that directory (which are built there first if missing).
+    """
+    groups = dict()
+    group_order = list()
+    for pip in merge(pips):
+        options = pip.get('options')
+        if options:
+            options = str(options)
+        if options not in groups:
+            groups[options] = list()
+            group_order.append(options)
+        groups[options].append(pip)
+    root_cmd = distro.get_command('pip')
+    for options in group_order:
+        names = [_make_pip_name(p['name'], p.get('version')) for p in groups[options]]
+        LOG.audit("Installing python packages (%s) using pip command (%s)" % (", ".join(names), root_cmd))
+        cmd_options = list()
+        if options:
+            LOG.debug("Using pip options: %s" % (options))
+            cmd_options.append(options)
+        with utils.tempdir() as tdir:
+            requires_fn = sh.joinpths(tdir, PIP_REQUIRES_FN)
+            sh.write_file(requires_fn, utils.joinlinesep(*names))
+            with INSTALL_LOCK:
+                if cache_dir and _install_cached(root_cmd, cmd_options, requires_fn, cache_dir):
+                    continue
+                real_cmd = [root_cmd, 'install'] + PIP_INSTALL_CMD_OPTS + cmd_options
+                real_cmd += ['-r', requires_fn]
+                sh.execute(*real_cmd, run_as_root=True)
 
 
 def uninstall(pip, distro, skip_errors=True):
@@ -51,7 +191,8 @@ def uninstall(pip, distro, skip_errors=True):
         name = _make_pip_name(pip['name'], None)
         LOG.audit("Uninstalling python package (%s) using pip command (%s)" % (name, root_cmd))
         cmd = [root_cmd, 'uninstall'] + PIP_UNINSTALL_CMD_OPTS + [name]
-        sh.execute(*cmd, run_as_root=True)
+        with INSTALL_LOCK:
+            sh.execute(*cmd, run_as_root=True)
     except excp.ProcessExecutionError:
         if skip_errors:
             LOG.debug(("Ignoring execution error that occured when uninstalling pip %s!"
@@ -14,11 +14,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License..
 
+import hashlib
+import json
+
+from devstack import downloader as down
 from devstack import env_rc
 from devstack import exceptions as excp
 from devstack import log as logging
+from devstack import pip
 from devstack import settings
 from devstack import shell as sh
+from devstack import timeline
+from devstack import trace as tr
+from devstack import workers
 
 LOG = logging.getLogger("devstack.progs.actions")
 
@@ -28,90 +36,104 @@ REVERSE_ACTIONS = [settings.UNINSTALL, settings.STOP]
 # For these actions we will attempt to make an rc file if it does not exist
 RC_FILE_MAKE_ACTIONS = [settings.INSTALL]
 
-# The order of which uninstalls happen + message of what is happening
-# (before and after)
+# The order of which uninstalls happen + the name of that phase + message
+# of what is happening (before and after)
 UNINSTALL_ORDERING = [
      (
+         "unconfigure",
          "Unconfiguring {name}.",
          (lambda instance: (instance.unconfigure())),
          None,
      ),
      (
+         "pre_uninstall",
          "Pre-uninstalling {name}.",
          (lambda instance: (instance.pre_uninstall())),
          None,
      ),
      (
+         "uninstall",
          "Uninstalling {name}.",
          (lambda instance: (instance.uninstall())),
          None,
      ),
      (
+         "post_uninstall",
          "Post-uninstalling {name}.",
          (lambda instance: (instance.post_uninstall())),
          None,
      ),
 ]
 
-# The order of which starts happen + message of what is happening
-# (before and after)
+# The order of which starts happen + the name of that phase + message
+# of what is happening (before and after)
 STARTS_ORDERING = [
      (
+        "configure",
         "Configuring runner for {name}.",
         (lambda instance: (instance.configure())),
         None,
      ),
      (
+        "pre_start",
         "Pre-starting {name}.",
         (lambda instance: (instance.pre_start())),
         None,
      ),
      (
+        "start",
         "Starting {name}.",
         (lambda instance: (instance.start())),
         "Started {result} applications.",
      ),
      (
+        "post_start",
         "Post-starting {name}.",
         (lambda instance:(instance.post_start())),
         None,
      ),
 ]
 
-# The order of which stops happen + message of what is happening
-# (before and after)
+# The order of which stops happen + the name of that phase + message
+# of what is happening (before and after)
 STOPS_ORDERING = [
      (
+         "stop",
          "Stopping {name}.",
          (lambda instance:(instance.stop())),
          "Stopped {result} items.",
      ),
 ]
 
-# The order of which install happen + message of what is happening
-# (before and after)
+# The order of which install happen + the name of that phase + message
+# of what is happening (before and after)
 INSTALL_ORDERING = [
     (
+        "download",
         "Downloading {name}.",
         (lambda instance: (instance.download())),
         "Performed {result} downloads.",
     ),
     (
+        "configure",
         "Configuring {name}.",
         (lambda instance: (instance.configure())),
         "Configured {result} items.",
     ),
     (
+        "pre_install",
         "Pre-installing {name}.",
         (lambda instance: (instance.pre_install())),
         None,
     ),
     (
+        "install",
         "Installing {name}.",
         (lambda instance: (instance.install())),
         "Finished install of {name} - check {result} for traces of what happened.",
     ),
     (
+        "post_install",
         "Post-installing {name}.",
         (lambda instance: (instance.post_install())),
         None,
@@ -126,6 +148,34 @@ ACTION_MP = {
     settings.UNINSTALL: UNINSTALL_ORDERING,
 }
 
+# For these actions (when running in parallel) a component moves on to its
+# next phase as soon as it has finished its previous one instead of waiting
+# for every other component to finish that phase first
+PIPELINE_ACTIONS = [settings.INSTALL]
+
+# These phases do not need a components dependencies to have finished the
+# same phase before they start (ie all the downloads can happen at once)
+UNORDERED_PHASES = ['download']
+
+# Before this phase (of these actions) the packages (and pips) of all the
+# components are installed together, that needs nothing from the phases
+# before it (ie the downloads) so when pipelining it runs alongside them
+BATCH_INSTALL_PHASES = {
+    settings.INSTALL: 'pre_install',
+}
+BATCH_NODE = (None, 'batch_install')
+
+# For these actions we journal each completed (component, phase) so that a
+# failed run can be resumed from where it stopped
+JOURNAL_ACTIONS = [settings.INSTALL, settings.START]
+
+# Completing these actions makes the journal of the paired action stale
+# (ie after uninstalling a resumed install should start from the beginning)
+JOURNAL_RESETS = {
+    settings.UNINSTALL: settings.INSTALL,
+    settings.STOP: settings.START,
+}
+
 # These actions must have there prerequisite action accomplished (if
 # determined by the boolean lambda to be needed)
 PREQ_ACTIONS = {
@@ -145,6 +195,23 @@ class ActionRunner(object):
         self.pkg_manager = pkg_manager
         self.keep_old = kargs.get('keep_old', False)
         self.force = kargs.get('force', False)
+        self.parallel = max(1, int(kargs.get('parallel') or 1))
+        self.resume = kargs.get('resume', False)
+        self.converge = kargs.get('converge', False)
+        # Downloads only run at the same time when we were asked to run
+        # things in parallel (--parallel 1 means one thing at a time)
+        self.download_workers = 1
+        if cfg and self.parallel > 1:
+            self.download_workers = down.max_workers(cfg)
+        # Shared by the components so the bound holds across all of them
+        self.download_manager = down.DownloadManager(self.download_workers)
+        # Per action the fingerprint of each components inputs, the journal
+        # writer for that component and the last journal entry of each phase
+        self.fingerprints = dict()
+        self.journals = dict()
+        self.completed = dict()
+        # Where the output of things done for all components goes (set by run)
+        self.root_dir = None
 
     def _apply_reverse(self, action, component_order):
         adjusted_order = list(component_order)
@@ -152,11 +219,23 @@ class ActionRunner(object):
             adjusted_order.reverse()
         return adjusted_order
 
+    def _fingerprint(self, cls, cls_kvs):
+        inputs = dict()
+        inputs['class'] = "%s.%s" % (cls.__module__, cls.__name__)
+        for (k, v) in cls_kvs.items():
+            if k in ['runner', 'all_instances']:
+                continue
+            if isinstance(v, (set, frozenset)):
+                v = sorted(v)
+            inputs[k] = v
+        return hashlib.md5(json.dumps(inputs, sort_keys=True, default=str)).hexdigest()
+
     def _construct_instances(self, persona, action, root_dir):
         components = persona.wanted_components
         desired_subsystems = persona.wanted_subsystems or dict()
         component_opts = persona.component_options or dict()
         instances = dict()
+        fingerprints = dict()
         for c in components:
             (cls, my_info) = self.distro.extract_component(c, action)
             LOG.debug("Constructing class %s" % (cls))
@@ -174,6 +253,8 @@ class ActionRunner(object):
                 if k not in cls_kvs:
                     cls_kvs[k] = v
             instances[c] = cls(**cls_kvs)
+            fingerprints[c] = self._fingerprint(cls, cls_kvs)
+        self.fingerprints[action] = fingerprints
         return instances
 
     def _verify_components(self, component_order, instances):
@@ -198,21 +279,182 @@ class ActionRunner(object):
             am_upd = writer.update(settings.OSRC_FN)
             LOG.info("Updated [%s] settings in rc file [%s]" % (am_upd, settings.OSRC_FN))
 
-    def _run_instances(self, action, component_order, instances):
-        for (start_msg, functor, end_msg) in ACTION_MP[action]:
-            for c in component_order:
-                instance = instances[c]
-                if start_msg:
-                    LOG.info(start_msg.format(name=c))
-                try:
+    def _get_dependencies(self, action, component_order):
+        # Only the dependencies between the components we are activating matter
+        all_deps = self.distro.resolve_component_dependencies(component_order)
+        deps = dict()
+        for c in component_order:
+            deps[c] = set([d for d in all_deps.get(c, set()) if d in component_order])
+        if action in REVERSE_ACTIONS:
+            deps = workers.invert_dependencies(component_order, deps)
+        return deps
+
+    def _open_journals(self, action, component_order, instances):
+        journals = dict()
+        completed = dict()
+        for c in component_order:
+            trace_dir = instances[c].trace_dir
+            if action in JOURNAL_RESETS:
+                sh.unlink(tr.journal_fn(trace_dir, JOURNAL_RESETS[action]))
+            journals[c] = None
+            completed[c] = dict()
+            if action not in JOURNAL_ACTIONS:
+                continue
+            journal_fn = tr.journal_fn(trace_dir, action)
+            if self.resume or self.converge:
+                reader = tr.TraceReader(journal_fn)
+                if reader.exists():
+                    for entry in reader.phases_completed():
+                        if entry.get('action') == action:
+                            completed[c][entry.get('phase')] = entry
+            else:
+                sh.unlink(journal_fn)
+            journals[c] = tr.TraceWriter(journal_fn, break_if_there=False, buffered=True)
+        self.journals[action] = journals
+        self.completed[action] = completed
+
+    def _hash_inputs(self, phase, instance):
+        if not self.converge:
+            return None
+        inputs = instance.phase_inputs(phase)
+        if inputs is None:
+            return None
+        return hashlib.md5(json.dumps(inputs, sort_keys=True, default=str)).hexdigest()
+
+    def _is_completed(self, action, phase, name, instance, quiet=False):
+        entry = self.completed[action][name].get(phase)
+        if not entry or entry.get('fingerprint') != self.fingerprints[action][name]:
+            return False
+        if self.resume:
+            if not quiet:
+                LOG.info("Skipping %s of %s (it was completed by a previous run)." % (phase, name))
+            return True
+        inputs = self._hash_inputs(phase, instance)
+        if inputs is not None and entry.get('inputs') == inputs:
+            if not quiet:
+                LOG.info("Skipping %s of %s (its inputs have not changed)." % (phase, name))
+            return True
+        return False
+
+    def _batch_install(self, action, component_order, instances):
+        # One (de-duplicated) package transaction for all the components
+        # that are about to install (instead of one per component)
+        phase = BATCH_INSTALL_PHASES[action]
+        wanted = list()
+        pkgs = list()
+        pips = list()
+        for c in component_order:
+            if self._is_completed(action, phase, c, instances[c], quiet=True):
+                continue
+            wanted.append(c)
+            pkgs.extend(instances[c].batch_packages())
+            pips.append((c, instances[c].batch_pips()))
+        # Conflicts are found before anything gets installed
+        pips = pip.merge_all(pips)
+        with timeline.span("batch install", timeline.PHASE_CAT, action=action):
+            for c in wanted:
+                instances[c].batch_pre_install()
+            if pkgs:
+                LOG.info("Installing the packages of (%s) together." % (", ".join(wanted)))
+                output_fn = None
+                if self.root_dir:
+                    output_fn = tr.output_fn(self.root_dir, 'packages')
+                self.pkg_manager.install_batch(pkgs, output_fn=output_fn)
+            if pips:
+                LOG.info("Installing the pips of (%s) together." % (", ".join(wanted)))
+                pip.install_batch(pips, self.distro, pip.get_cache_dir(self.cfg))
+        for c in wanted:
+            instances[c].packages_batched = True
+
+    def _run_instance(self, action, phase_info, name, instance):
+        (phase, start_msg, functor, end_msg) = phase_info
+        if self._is_completed(action, phase, name, instance):
+            return
+        if start_msg:
+            LOG.info(start_msg.format(name=name))
+        try:
+            try:
+                with timeline.span("%s: %s" % (name, phase), timeline.PHASE_CAT,
+                                   action=action, component=name, phase=phase):
                     result = functor(instance)
-                    if end_msg:
-                        LOG.info(end_msg.format(name=c, result=result))
-                except (excp.NoTraceException) as e:
-                    if self.force:
-                        LOG.debug("Skipping exception [%s]" % (e))
-                    else:
-                        raise
+                if end_msg:
+                    LOG.info(end_msg.format(name=name, result=result))
+            except (excp.NoTraceException) as e:
+                if self.force:
+                    LOG.debug("Skipping exception [%s]" % (e))
+                    # The phase did not finish so it must run again on resume
+                    return
+                else:
+                    raise
+            journal = self.journals[action][name]
+            if journal:
+                # The inputs are taken after the phase ran since it may have changed
+                # them (ie a download changes what revision is checked out)
+                journal.phase_completed(action, phase, self.fingerprints[action][name],
+                                        self._hash_inputs(phase, instance))
+        finally:
+            # Phase boundaries are where the buffered traces are made durable
+            tr.sync_all()
+
+    def _run_pipelined(self, action, phases, component_order, deps, instances):
+        # Each (component, phase) waits for the previous phase of that component
+        # and (unless its unordered) for its dependencies to finish that phase
+        phase_lookup = dict()
+        node_order = list()
+        node_deps = dict()
+        for c in component_order:
+            prior_node = None
+            for phase_info in phases:
+                phase = phase_info[0]
+                phase_lookup[phase] = phase_info
+                node = (c, phase)
+                needs = set()
+                if prior_node:
+                    needs.add(prior_node)
+                if phase not in UNORDERED_PHASES:
+                    needs.update([(d, phase) for d in deps[c]])
+                node_deps[node] = needs
+                node_order.append(node)
+                prior_node = node
+        if action in BATCH_INSTALL_PHASES:
+            # Every components batched phase waits on the batch which needs
+            # nothing else (so it starts first and runs alongside the downloads)
+            batch_phase = BATCH_INSTALL_PHASES[action]
+            node_deps[BATCH_NODE] = set()
+            node_order.insert(0, BATCH_NODE)
+            for c in component_order:
+                node_deps[(c, batch_phase)].add(BATCH_NODE)
+
+        def run_phase(node):
+            if node == BATCH_NODE:
+                self._batch_install(action, component_order, instances)
+                return
+            (c, phase) = node
+            self._run_instance(action, phase_lookup[phase], c, instances[c])
+
+        workers.run_graph(node_order, node_deps, run_phase, self.parallel)
+
+    def _run_instances(self, action, component_order, instances):
+        deps = self._get_dependencies(action, component_order)
+        phases = ACTION_MP[action]
+        if self.parallel > 1:
+            LOG.info("Running up to %s components at once for action [%s]" % (self.parallel, action))
+            if action in PIPELINE_ACTIONS:
+                self._run_pipelined(action, phases, component_order, deps, instances)
+                return
+        for phase_info in phases:
+            if BATCH_INSTALL_PHASES.get(action) == phase_info[0]:
+                self._batch_install(action, component_order, instances)
+
+            def run_component(c):
+                self._run_instance(action, phase_info, c, instances[c])
+
+            if phase_info[0] in UNORDERED_PHASES:
+                # These can run at the same time (ie downloads) when in parallel
+                workers.run_graph(component_order, dict(), run_component,
+                                  max(self.parallel, self.download_workers))
+            else:
+                workers.run_graph(component_order, deps, run_component, self.parallel)
 
     def _run_action(self, persona, action, root_dir):
         instances = self._construct_instances(persona, action, root_dir)
@@ -233,7 +475,11 @@ class ActionRunner(object):
         self._warm_components(component_order, instances)
         if action in RC_FILE_MAKE_ACTIONS:
             self._write_rc_file(root_dir)
+        self._open_journals(action, component_order, instances)
         self._run_instances(action, component_order, instances)
+        self.pkg_manager.finish()
 
     def run(self, persona, root_dir):
-        self._run_action(persona, self.action, root_dir)
+        self.root_dir = root_dir
+        with timeline.span(self.action, timeline.ACTION_CAT, action=self.action):
+            self._run_action(persona, self.action, root_dir)
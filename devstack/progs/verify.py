@@ -0,0 +1,183 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+
+from devstack import exceptions as excp
+from devstack import log as logging
+from devstack import settings
+from devstack import shell as sh
+from devstack import trace as tr
+from devstack import workers
+
+LOG = logging.getLogger("devstack.progs.verify")
+
+# How many paths we will check at the same time
+MAX_WORKERS = 8
+
+# What we exit with when drift was found (so scripts can tell it apart)
+DRIFT_EXIT_CODE = 2
+
+# What can be wrong with a path that was traced
+OK = "ok"
+MISSING = "missing"
+MODIFIED = "modified"
+EXTRA = "extra"
+UNREADABLE = "unreadable"
+
+# What kind of things were traced (and how we check they still exist)
+DIR = "directory"
+FILE = "file"
+LINK = "symlink"
+CONFIG = "config"
+_EXISTS = {
+    DIR: sh.isdir,
+    FILE: sh.exists,
+    LINK: sh.islink,
+    CONFIG: sh.exists,
+}
+
+
+def _md5(fn):
+    digest = hashlib.md5()
+    with open(fn, 'rb') as fh:
+        while True:
+            data = fh.read(64 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _check(item):
+    (_, kind, path, md5) = item
+    if not _EXISTS[kind](path):
+        return MISSING
+    if kind == CONFIG and md5:
+        try:
+            if _md5(path) != md5:
+                return MODIFIED
+        except (IOError, OSError):
+            return UNREADABLE
+    return OK
+
+
+class Verifier(object):
+    """
+    Compares what the install traces of the given components say should be
+    on disk with what actually is on disk (and reports the differences).
+    """
+
+    def __init__(self, root_dir, components, max_workers=MAX_WORKERS, distro=None):
+        self.root_dir = root_dir
+        self.components = components
+        self.max_workers = max_workers
+        # Used to ask git which files in a checkout are shipped with it
+        self.distro = distro
+
+    def _reader(self, component):
+        return tr.TraceReader(tr.trace_fn(sh.joinpths(self.root_dir, component,
+                                                      settings.COMPONENT_TRACE_DIR),
+                                          tr.IN_TRACE))
+
+    def _traced(self, component):
+        reader = self._reader(component)
+        items = list()
+        if not reader.exists():
+            LOG.info("No install trace found for %r, skipping it." % (component))
+            return items
+        # Files the component removes (or moves) on purpose are not expected
+        removed = set(reader.files_removed())
+        for path in reader.dirs_made():
+            items.append((component, DIR, path, None))
+        for path in reader.files_touched():
+            if path not in removed:
+                items.append((component, FILE, path, None))
+        for path in reader.symlinks_made():
+            items.append((component, LINK, path, None))
+        hashes = reader.files_configured_hashes()
+        for path in reader.files_configured():
+            if path not in removed:
+                items.append((component, CONFIG, path, hashes.get(path)))
+        return items
+
+    def _shipped(self, cfg_dir, checkouts):
+        # The files in the config dir that come with a (git) checkout
+        shipped = set()
+        if self.distro is None:
+            return shipped
+        for where in checkouts:
+            if cfg_dir != where and not cfg_dir.startswith(where + os.sep):
+                continue
+            cmd = list(self.distro.get_command('git', 'ls-files'))
+            try:
+                (stdout, _) = sh.execute(*cmd, cwd=cfg_dir)
+            except excp.ProcessExecutionError as e:
+                LOG.warn("Unable to list the files git knows about in %r: %s" % (cfg_dir, e))
+                continue
+            for fn in stdout.splitlines():
+                shipped.add(sh.joinpths(cfg_dir, fn.strip()))
+        return shipped
+
+    def _extras(self, component, known):
+        # Anything in the dirs a component writes its configs to that we
+        # did not write ourselves (and that does not come with its checkout)
+        reader = self._reader(component)
+        extras = list()
+        if not reader.exists():
+            return extras
+        cfg_dirs = set([sh.dirname(path) for path in reader.files_configured()])
+        checkouts = [where for (where, _) in reader.download_locations() if where]
+        for cfg_dir in sorted(cfg_dirs):
+            if not sh.isdir(cfg_dir):
+                continue
+            shipped = self._shipped(cfg_dir, checkouts)
+            for fn in sorted(sh.listdir(cfg_dir)):
+                path = sh.joinpths(cfg_dir, fn)
+                if sh.isfile(path) and path not in known and path not in shipped:
+                    extras.append((component, EXTRA, path))
+        return extras
+
+    def verify(self):
+        """Returns a list of (component, status, path) for each difference found."""
+        items = list()
+        for c in self.components:
+            items.extend(self._traced(c))
+        LOG.info("Checking %s traced paths using %s workers." % (len(items), self.max_workers))
+        statuses = workers.map_pool(_check, items, self.max_workers)
+        drift = list()
+        for (item, status) in zip(items, statuses):
+            if status != OK:
+                drift.append((item[0], status, item[2]))
+        for c in self.components:
+            known = set([path for (who, _, path, _) in items if who == c])
+            drift.extend(self._extras(c, known))
+        return drift
+
+    def run(self):
+        drift = self.verify()
+        for (component, status, path) in drift:
+            LOG.warn("%s: %s is %s" % (component, path, status))
+        if not drift:
+            LOG.info("No drift found for components (%s)." % (", ".join(self.components)))
+        else:
+            counts = dict()
+            for (_, status, _) in drift:
+                counts[status] = counts.get(status, 0) + 1
+            summary = ", ".join(["%s %s" % (counts[s], s) for s in sorted(counts.keys())])
+            LOG.warn("Found drift in %s paths (%s)." % (len(drift), summary))
+        return drift
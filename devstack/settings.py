@@ -53,11 +53,13 @@ INSTALL = "install"
 UNINSTALL = "uninstall"
 START = "start"
 STOP = "stop"
-ACTIONS = [INSTALL, UNINSTALL, START, STOP]
+VERIFY = "verify"
+ACTIONS = [INSTALL, UNINSTALL, START, STOP, VERIFY]
 
 # Where the configs and templates should be at.
 STACK_BIN_DIR = os.path.abspath(os.path.dirname(sys.argv[0]))
 STACK_CONFIG_DIR = os.path.join(STACK_BIN_DIR, "conf")
 STACK_DISTRO_DIR = os.path.join(STACK_CONFIG_DIR, "distros")
 STACK_TEMPLATE_DIR = os.path.join(STACK_CONFIG_DIR, "templates")
+STACK_TEMPLATE_BUNDLE = os.path.join(STACK_CONFIG_DIR, "templates.bundle")
 STACK_CONFIG_LOCATION = os.path.join(STACK_CONFIG_DIR, "stack.ini")
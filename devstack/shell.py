@@ -14,25 +14,38 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import errno
 import fileinput
 import getpass
 import grp
+import hashlib
 import os
 import pwd
+import select
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
 from devstack import env
 from devstack import exceptions as excp
 from devstack import log as logging
+from devstack import timeline
 
 LOG = logging.getLogger("devstack.shell")
 ROOT_USER = "root"
 ROOT_USER_UID = 0
 SUDO_UID = 'SUDO_UID'
 SUDO_GID = 'SUDO_GID'
+
+# What write_file_if_changed() did
+FILE_CREATED = "created"
+FILE_MODIFIED = "modified"
+FILE_UNCHANGED = "unchanged"
+
 SHELL_QUOTE_REPLACERS = {
     "\"": "\\\"",
     "(": "\\(",
@@ -46,6 +59,16 @@ DRYRUN_MODE = False
 DRY_RC = 0
 DRY_STDOUT_ERR = ("", "")
 
+# How much (at most) gather() reads from or writes to a command at once and how
+# long (in seconds) it waits on commands before checking if they have finished
+EXEC_READ_SIZE = 64 * 1024
+EXEC_WRITE_SIZE = 4096
+EXEC_WAIT = 0.1
+
+# How many of the last output lines of a command that streams its output to a
+# file are kept in memory (for errors and the like)
+OUTPUT_TAIL_LINES = 50
+
 
 def set_dryrun(val):
     global DRYRUN_MODE
@@ -59,28 +82,50 @@ def set_dryrun(val):
 
 #root context guard
 class Rooted(object):
+    # Root mode is process wide, so only one thread at a time may be in it
+    # (the lock is held until it exits) and the helpers in here that create
+    # things as the user take the same lock so they never run as root
+    _lock = threading.RLock()
+    _depth = 0
+
     def __init__(self, run_as_root):
         self.root_mode = run_as_root
         self.engaged = False
 
     def __enter__(self):
-        if self.root_mode and not got_root():
-            root_mode()
-            self.engaged = True
+        if self.root_mode:
+            Rooted._lock.acquire()
+            Rooted._depth += 1
+            if Rooted._depth == 1 and not got_root():
+                root_mode()
+                self.engaged = True
         return self.engaged
 
     def __exit__(self, type, value, traceback):
-        if self.root_mode and self.engaged:
-            user_mode()
-            self.engaged = False
+        if self.root_mode:
+            try:
+                if self.engaged:
+                    user_mode()
+                    self.engaged = False
+            finally:
+                Rooted._depth -= 1
+                Rooted._lock.release()
 
 
-def execute(*cmd, **kwargs):
-    process_input = kwargs.pop('process_input', None)
+def _child_root_mode():
+    # Ran in a forked child (before exec) so only the child gets root
+    os.setreuid(0, 0)
+    os.setregid(0, 0)
+
+
+def _prepare_execute(cmd, kwargs):
+    # Turns the arguments given to execute() into what is needed to run it
+    options = dict()
+    options['process_input'] = kwargs.pop('process_input', None)
     check_exit_code = kwargs.pop('check_exit_code', [0])
-    cwd = kwargs.pop('cwd', None)
+    options['cwd'] = kwargs.pop('cwd', None)
     env_overrides = kwargs.pop('env_overrides', None)
-    close_stdin = kwargs.pop('close_stdin', False)
+    options['close_stdin'] = kwargs.pop('close_stdin', False)
     ignore_exit_code = kwargs.pop('ignore_exit_code', False)
 
     if isinstance(check_exit_code, bool):
@@ -88,9 +133,13 @@ def execute(*cmd, **kwargs):
         check_exit_code = [0]
     elif isinstance(check_exit_code, int):
         check_exit_code = [check_exit_code]
+    options['check_exit_code'] = check_exit_code
+    options['ignore_exit_code'] = ignore_exit_code
+    options['output_fn'] = kwargs.pop('output_fn', None)
 
-    run_as_root = kwargs.pop('run_as_root', False)
+    options['run_as_root'] = kwargs.pop('run_as_root', False)
     shell = kwargs.pop('shell', False)
+    options['shell'] = shell
 
     execute_cmd = list()
     for c in cmd:
@@ -99,35 +148,42 @@ def execute(*cmd, **kwargs):
     str_cmd = " ".join(execute_cmd)
     if shell:
         execute_cmd = str_cmd.strip()
+    options['execute_cmd'] = execute_cmd
+    options['str_cmd'] = str_cmd
 
     if not shell:
         LOG.audit('Running cmd: %s' % (execute_cmd))
     else:
         LOG.audit('Running shell cmd: %s' % (execute_cmd))
 
-    if process_input is not None:
-        LOG.audit('With stdin: %s' % (process_input))
+    if options['process_input'] is not None:
+        LOG.audit('With stdin: %s' % (options['process_input']))
 
-    if cwd:
-        LOG.audit("In working directory: %s" % (cwd))
+    if options['cwd']:
+        LOG.audit("In working directory: %s" % (options['cwd']))
 
-    stdin_fh = subprocess.PIPE
-    stdout_fh = subprocess.PIPE
-    stderr_fh = subprocess.PIPE
-    close_file_descriptors = True
+    options['stdin_fh'] = subprocess.PIPE
+    options['stdout_fh'] = subprocess.PIPE
+    options['stderr_fh'] = subprocess.PIPE
 
     if 'stdout_fh' in kwargs.keys():
-        stdout_fh = kwargs.get('stdout_fh')
-        LOG.debug("Redirecting stdout to file handle: %s" % (stdout_fh))
+        options['stdout_fh'] = kwargs.get('stdout_fh')
+        LOG.debug("Redirecting stdout to file handle: %s" % (options['stdout_fh']))
 
     if 'stdin_fh' in kwargs.keys():
-        stdin_fh = kwargs.get('stdin_fh')
-        LOG.debug("Redirecting stdin to file handle: %s" % (stdin_fh))
-        process_input = None
+        options['stdin_fh'] = kwargs.get('stdin_fh')
+        LOG.debug("Redirecting stdin to file handle: %s" % (options['stdin_fh']))
+        options['process_input'] = None
 
     if 'stderr_fh' in kwargs.keys():
-        stderr_fh = kwargs.get('stderr_fh')
-        LOG.debug("Redirecting stderr to file handle: %s" % (stderr_fh))
+        options['stderr_fh'] = kwargs.get('stderr_fh')
+        LOG.debug("Redirecting stderr to file handle: %s" % (options['stderr_fh']))
+    elif options['output_fn']:
+        # Keep the streamed output in the order it was written
+        options['stderr_fh'] = subprocess.STDOUT
+
+    if options['output_fn']:
+        LOG.audit("Streaming output to: %s" % (options['output_fn']))
 
     process_env = None
     if env_overrides and len(env_overrides):
@@ -135,36 +191,32 @@ def execute(*cmd, **kwargs):
         LOG.audit("With additional environment overrides: %s" % (env_overrides))
         for (k, v) in env_overrides.items():
             process_env[k] = str(v)
+    options['process_env'] = process_env
+    return options
 
-    rc = None
-    result = None
-    with Rooted(run_as_root):
-        if DRYRUN_MODE:
-            rc = DRY_RC
-            result = DRY_STDOUT_ERR
-        else:
-            try:
-                obj = subprocess.Popen(execute_cmd,
-                                       stdin=stdin_fh,
-                                       stdout=stdout_fh,
-                                       stderr=stderr_fh,
-                                       close_fds=close_file_descriptors,
-                                       cwd=cwd,
-                                       shell=shell,
-                                       env=process_env)
-                if process_input is not None:
-                    result = obj.communicate(str(process_input))
-                else:
-                    result = obj.communicate()
-            except OSError as e:
-                error_description = "%s: [%s, %s]" % (e.message, e.errno, e.strerror)
-                raise excp.ProcessExecutionError(description=error_description, cmd=str_cmd)
-            if (stdin_fh != subprocess.PIPE
-                and obj.stdin and close_stdin):
-                obj.stdin.close()
-            rc = obj.returncode
-        LOG.audit('Cmd result had exit code: %s' % rc)
 
+def _spawn(options):
+    preexec_fn = None
+    if options['run_as_root'] and not got_root():
+        preexec_fn = _child_root_mode
+    try:
+        # Forking while another thread is rooted would make a root child
+        with Rooted._lock:
+            return subprocess.Popen(options['execute_cmd'],
+                                    stdin=options['stdin_fh'],
+                                    stdout=options['stdout_fh'],
+                                    stderr=options['stderr_fh'],
+                                    close_fds=True,
+                                    cwd=options['cwd'],
+                                    shell=options['shell'],
+                                    env=options['process_env'],
+                                    preexec_fn=preexec_fn)
+    except OSError as e:
+        error_description = "%s: [%s, %s]" % (e.message, e.errno, e.strerror)
+        raise excp.ProcessExecutionError(description=error_description, cmd=options['str_cmd'])
+
+
+def _check_result(options, rc, result):
     if not result:
         result = ("", "")
 
@@ -174,7 +226,9 @@ def execute(*cmd, **kwargs):
     if stderr is None:
         stderr = ''
 
-    if (not ignore_exit_code) and (rc not in check_exit_code):
+    str_cmd = options['str_cmd']
+    check_exit_code = options['check_exit_code']
+    if (not options['ignore_exit_code']) and (rc not in check_exit_code):
         raise excp.ProcessExecutionError(exit_code=rc, stdout=stdout, \
                                          stderr=stderr, cmd=str_cmd)
     else:
@@ -188,6 +242,220 @@ def execute(*cmd, **kwargs):
         return (stdout, stderr)
 
 
+def execute(*cmd, **kwargs):
+    """
+    Runs the given command and returns its (stdout, stderr). When output_fn
+    is given the output is streamed into that file instead and stdout is a
+    StreamedOutput of only the last lines of it.
+    """
+    if kwargs.get('output_fn'):
+        return execute_async(*cmd, **kwargs).result()
+    options = _prepare_execute(cmd, kwargs)
+    str_cmd = options['str_cmd']
+    rc = None
+    result = None
+    with timeline.span(str_cmd, timeline.CMD_CAT, cmd=str_cmd, cwd=options['cwd']):
+        if DRYRUN_MODE:
+            rc = DRY_RC
+            result = DRY_STDOUT_ERR
+        else:
+            obj = _spawn(options)
+            try:
+                if options['process_input'] is not None:
+                    result = obj.communicate(str(options['process_input']))
+                else:
+                    result = obj.communicate()
+            except OSError as e:
+                error_description = "%s: [%s, %s]" % (e.message, e.errno, e.strerror)
+                raise excp.ProcessExecutionError(description=error_description, cmd=str_cmd)
+            if (options['stdin_fh'] != subprocess.PIPE
+                and obj.stdin and options['close_stdin']):
+                obj.stdin.close()
+            rc = obj.returncode
+        LOG.audit('Cmd result had exit code: %s' % rc)
+    return _check_result(options, rc, result)
+
+
+class StreamedOutput(str):
+    """The last lines a command output (its full output is in filename)."""
+
+    def __new__(cls, filename, lines):
+        output = str.__new__(cls, "".join(lines))
+        output.filename = filename
+        return output
+
+
+class PendingExecution(object):
+    """
+    A command started by execute_async() that has not (necessarily) finished
+    yet, its output is collected (and its input fed to it) by gather().
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.started = time.time()
+        self.proc = None
+        self.rc = None
+        self.value = None
+        self.failure = None
+        self.done = False
+        self.outputs = dict()
+        self.readers = dict()
+        self.stdin = None
+        self.pending_input = ''
+        self.log_fh = None
+        self.tail = None
+        self.partial_line = ''
+
+    def start(self):
+        output_fn = self.options['output_fn']
+        if DRYRUN_MODE:
+            if output_fn:
+                self._finish(DRY_RC, (StreamedOutput(output_fn, []), DRY_STDOUT_ERR[1]))
+            else:
+                self._finish(DRY_RC, DRY_STDOUT_ERR)
+            return self
+        if output_fn:
+            if not isdir(dirname(output_fn)):
+                mkdirslist(dirname(output_fn))
+            # Appended to so that a series of commands share one log
+            with Rooted._lock:
+                self.log_fh = open(output_fn, 'a')
+                self.log_fh.write("$ %s\n" % (self.options['str_cmd']))
+            self.tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        self.proc = _spawn(self.options)
+        for (name, fh) in [('stdout', self.proc.stdout), ('stderr', self.proc.stderr)]:
+            if fh is not None:
+                self.readers[fh.fileno()] = (name, fh)
+                self.outputs[name] = list()
+        if self.proc.stdin is not None and self.options['stdin_fh'] == subprocess.PIPE:
+            if self.options['process_input'] is not None:
+                self.stdin = self.proc.stdin
+                self.pending_input = str(self.options['process_input'])
+            else:
+                self.proc.stdin.close()
+        return self
+
+    def _close_stdin(self):
+        try:
+            self.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.stdin = None
+
+    def _read(self, fd):
+        (name, fh) = self.readers[fd]
+        data = os.read(fd, EXEC_READ_SIZE)
+        if data and self.log_fh is not None:
+            self._stream(data)
+        elif data:
+            self.outputs[name].append(data)
+        else:
+            fh.close()
+            self.readers.pop(fd)
+
+    def _stream(self, data):
+        self.log_fh.write(data)
+        lines = (self.partial_line + data).splitlines(True)
+        self.partial_line = ''
+        if lines and not lines[-1].endswith("\n"):
+            self.partial_line = lines.pop()
+        self.tail.extend(lines)
+
+    def _write(self):
+        try:
+            written = os.write(self.stdin.fileno(), self.pending_input[0:EXEC_WRITE_SIZE])
+            self.pending_input = self.pending_input[written:]
+        except OSError as e:
+            # The command does not want the rest of its input
+            if e.errno != errno.EPIPE:
+                raise
+            self.pending_input = ''
+        if not self.pending_input:
+            self._close_stdin()
+
+    def _poll(self):
+        if self.done or self.readers or self.stdin is not None:
+            return self.done
+        rc = self.proc.poll()
+        if rc is not None:
+            result = list()
+            for name in ['stdout', 'stderr']:
+                if name in self.outputs:
+                    result.append("".join(self.outputs[name]))
+                else:
+                    result.append(None)
+            if self.log_fh is not None:
+                if self.partial_line:
+                    # So whatever gets appended next starts on its own line
+                    self.log_fh.write("\n")
+                    self.tail.append(self.partial_line)
+                self.log_fh.close()
+                result[0] = StreamedOutput(self.options['output_fn'], self.tail)
+            self._finish(rc, tuple(result))
+        return self.done
+
+    def _finish(self, rc, result):
+        str_cmd = self.options['str_cmd']
+        LOG.audit('Cmd result had exit code: %s' % rc)
+        timeline.record(str_cmd, timeline.CMD_CAT, self.started, time.time(),
+                        cmd=str_cmd, cwd=self.options['cwd'])
+        self.rc = rc
+        self.done = True
+        try:
+            self.value = _check_result(self.options, rc, result)
+        except excp.ProcessExecutionError:
+            self.failure = sys.exc_info()
+
+    def result(self):
+        return gather(self)[0]
+
+
+def execute_async(*cmd, **kwargs):
+    """
+    Starts running a command (taking the same arguments as execute) and
+    returns a PendingExecution for it, gather() waits for pending commands.
+    """
+    options = _prepare_execute(cmd, kwargs)
+    return PendingExecution(options).start()
+
+
+def gather(*pendings):
+    """
+    Waits for all of the pending commands to finish (feeding their input and
+    collecting their output as it arrives) and returns what execute() would
+    have for each. When commands fail the first failure is raised once all
+    of them have finished.
+    """
+    active = [p for p in pendings if not p.done]
+    while active:
+        readers = dict()
+        writers = dict()
+        for p in active:
+            for fd in p.readers.keys():
+                readers[fd] = p
+            if p.stdin is not None:
+                writers[p.stdin.fileno()] = p
+        if readers or writers:
+            try:
+                (readable, writable, _) = select.select(readers.keys(), writers.keys(), [], EXEC_WAIT)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for fd in readable:
+                readers[fd]._read(fd)
+            for fd in writable:
+                writers[fd]._write()
+        else:
+            time.sleep(EXEC_WAIT)
+        active = [p for p in active if not p._poll()]
+    for p in pendings:
+        if p.failure is not None:
+            raise p.failure[0], p.failure[1], p.failure[2]
+    return [p.value for p in pendings]
+
+
 def abspth(path):
     if not path:
         path = ROOT_PATH
@@ -332,10 +600,11 @@ def append_file(fn, text, flush=True, quiet=False):
         LOG.audit("Appending to file %s (%d bytes) (flush=%s)", fn, len(text), flush)
         LOG.audit(">> %s" % (text))
     if not DRYRUN_MODE:
-        with open(fn, "a") as f:
-            f.write(text)
-            if flush:
-                f.flush()
+        with Rooted._lock:
+            with open(fn, "a") as f:
+                f.write(text)
+                if flush:
+                    f.flush()
     return fn
 
 
@@ -344,20 +613,78 @@ def write_file(fn, text, flush=True, quiet=False):
         LOG.audit("Writing to file %s (%d bytes) (flush=%s)", fn, len(text), flush)
         LOG.audit("> %s" % (text))
     if not DRYRUN_MODE:
-        with open(fn, "w") as f:
-            f.write(text)
-            if flush:
-                f.flush()
+        with Rooted._lock:
+            with open(fn, "w") as f:
+                f.write(text)
+                if flush:
+                    f.flush()
     return fn
 
 
+def _same_contents(fn, text):
+    if getsize(fn) != len(text):
+        return False
+    digest = hashlib.md5()
+    with open(fn, "rb") as f:
+        while True:
+            data = f.read(64 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest() == hashlib.md5(text).hexdigest()
+
+
+def write_file_if_changed(fn, text, quiet=False):
+    """
+    Writes the text to the file (atomically, by renaming a temporary file
+    into place) unless the file already has those contents. Returns one of
+    FILE_CREATED, FILE_MODIFIED or FILE_UNCHANGED.
+    """
+    if not isfile(fn):
+        status = FILE_CREATED
+    elif _same_contents(fn, text):
+        status = FILE_UNCHANGED
+    else:
+        status = FILE_MODIFIED
+    if not quiet:
+        LOG.audit("Writing to file %s (%d bytes) (%s)", fn, len(text), status)
+    if status == FILE_UNCHANGED or DRYRUN_MODE:
+        return status
+    with Rooted._lock:
+        (fd, tmp_fn) = tempfile.mkstemp(prefix=".%s." % (basename(fn)), dir=dirname(fn))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if status == FILE_MODIFIED:
+                old_stat = os.stat(fn)
+                os.chmod(tmp_fn, old_stat.st_mode)
+                try:
+                    os.chown(tmp_fn, old_stat.st_uid, old_stat.st_gid)
+                except OSError:
+                    pass
+            else:
+                # Match what a plain open() would have made
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_fn, 0666 & ~umask)
+            os.rename(tmp_fn, fn)
+        finally:
+            # Only still there if something went wrong before the rename
+            if isfile(tmp_fn):
+                os.unlink(tmp_fn)
+    return status
+
+
 def touch_file(fn, die_if_there=True, quiet=False, file_size=0):
     if not isfile(fn):
         if not quiet:
             LOG.audit("Touching and truncating file %s (truncate size=%s)", fn, file_size)
         if not DRYRUN_MODE:
-            with open(fn, "w") as f:
-                f.truncate(file_size)
+            with Rooted._lock:
+                with open(fn, "w") as f:
+                    f.truncate(file_size)
     else:
         if die_if_there:
             msg = "Can not touch & truncate file %s since it already exists" % (fn)
@@ -377,16 +704,28 @@ def load_file(fn, quiet=False):
     return data
 
 
+def iter_file_lines(fn, quiet=False):
+    if not quiet:
+        LOG.audit("Reading lines from file %s", fn)
+    if DRYRUN_MODE:
+        return
+    with open(fn, "r") as f:
+        for line in f:
+            yield line
+
+
 def mkdir(path, recurse=True):
     if not isdir(path):
         if recurse:
             LOG.audit("Recursively creating directory \"%s\"" % (path))
             if not DRYRUN_MODE:
-                os.makedirs(path)
+                with Rooted._lock:
+                    os.makedirs(path)
         else:
             LOG.audit("Creating directory \"%s\"" % (path))
             if not DRYRUN_MODE:
-                os.mkdir(path)
+                with Rooted._lock:
+                    os.mkdir(path)
 
 
 def deldir(path, run_as_root=False):
@@ -433,6 +772,14 @@ def basename(path):
     return os.path.basename(path)
 
 
+def getmtime(path):
+    return os.path.getmtime(path)
+
+
+def getsize(path):
+    return os.path.getsize(path)
+
+
 def dirname(path):
     return os.path.dirname(path)
 
@@ -0,0 +1,260 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import sqlite3
+import threading
+
+from devstack import exceptions as excp
+from devstack import log as logging
+from devstack import settings
+from devstack import shell as sh
+from devstack import trace as tr
+
+LOG = logging.getLogger("devstack.state")
+
+# What (in the root directory) the state database is called
+STATE_FN = "state.sqlite"
+
+# The trace types we keep in the database (and how to find a path in them)
+PATH_TYPES = [tr.CFG_WRITING_FILE, tr.SYMLINK_MAKE, tr.DIR_MADE, tr.FILE_TOUCHED, tr.FILE_REMOVED]
+JSON_PATH_TYPES = {
+    tr.DOWNLOADED: 'target',
+    tr.PYTHON_INSTALL: 'where',
+    tr.AP_STARTED: 'trace_fn',
+    tr.CFG_FILE_HASH: 'fn',
+}
+RECORDED_TYPES = PATH_TYPES + JSON_PATH_TYPES.keys() + [tr.PKG_INSTALL, tr.PIP_INSTALL, tr.PHASE_DONE]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        component TEXT,
+        trace_fn TEXT NOT NULL,
+        type TEXT NOT NULL,
+        action TEXT,
+        path TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS events_component ON events (component, type)",
+    "CREATE INDEX IF NOT EXISTS events_trace ON events (trace_fn, type)",
+    "CREATE INDEX IF NOT EXISTS events_type ON events (type)",
+    "CREATE INDEX IF NOT EXISTS events_path ON events (path)",
+    # What each trace looked like when we last had all of it
+    """CREATE TABLE IF NOT EXISTS imports (
+        trace_fn TEXT PRIMARY KEY,
+        mtime REAL,
+        size INTEGER
+    )""",
+]
+
+# When none we are not mirroring traces
+_STORE = None
+
+
+def component_of(trace_fn):
+    """Returns which component a trace belongs to (based on where it is)."""
+    trace_dir = sh.dirname(trace_fn)
+    if sh.basename(trace_dir) != settings.COMPONENT_TRACE_DIR:
+        return None
+    return sh.basename(sh.dirname(trace_dir))
+
+
+def path_of(cmd, action):
+    """Returns the path a trace entry is about (if any)."""
+    if cmd in PATH_TYPES:
+        return action
+    if cmd in JSON_PATH_TYPES:
+        try:
+            entry = json.loads(action)
+        except ValueError:
+            return None
+        if type(entry) is dict:
+            return entry.get(JSON_PATH_TYPES[cmd])
+    return None
+
+
+class StateStore(object):
+    """
+    A sqlite database that mirrors the trace entries of all the components
+    in a root directory so that questions about them (ie which component made
+    a given directory) can be answered without reading every trace file.
+    """
+
+    def __init__(self, db_fn):
+        self.db_fn = db_fn
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_fn, check_same_thread=False)
+        # Traces recorded into since the last commit
+        self.dirty = set()
+        with self.lock:
+            for stmt in SCHEMA:
+                self.conn.execute(stmt)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def record(self, trace_fn, cmd, action):
+        if cmd not in RECORDED_TYPES:
+            return
+        row = (component_of(trace_fn), trace_fn, cmd, action, path_of(cmd, action))
+        # Committed when the traces are synced (ie at the end of each phase)
+        with self.lock:
+            self.conn.execute("INSERT INTO events (component, trace_fn, type, action, path)"
+                              " VALUES (?, ?, ?, ?, ?)", row)
+            self.dirty.add(trace_fn)
+
+    def _stat(self, trace_fn):
+        if not sh.isfile(trace_fn):
+            return None
+        return (sh.getmtime(trace_fn), sh.getsize(trace_fn))
+
+    def _mark_imported(self, trace_fn):
+        # Called with the lock held
+        stat = self._stat(trace_fn)
+        if stat is None:
+            return
+        self.conn.execute("INSERT OR REPLACE INTO imports (trace_fn, mtime, size)"
+                          " VALUES (?, ?, ?)", (trace_fn,) + stat)
+
+    def commit(self):
+        # The writers were synced before this so the traces we recorded into
+        # are now the same as what we have of them
+        with self.lock:
+            for trace_fn in self.dirty:
+                self._mark_imported(trace_fn)
+            self.dirty = set()
+            self.conn.commit()
+
+    def forget(self, trace_fn):
+        with self.lock:
+            self.conn.execute("DELETE FROM events WHERE trace_fn = ?", (trace_fn,))
+            self.conn.execute("DELETE FROM imports WHERE trace_fn = ?", (trace_fn,))
+            self.dirty.discard(trace_fn)
+            self.conn.commit()
+
+    def prune(self):
+        """Forgets about the traces that no longer exist (ie they were uninstalled)."""
+        with self.lock:
+            trace_fns = [row[0] for row in self.conn.execute("SELECT trace_fn FROM events"
+                                                             " UNION SELECT trace_fn FROM imports")]
+        am_pruned = 0
+        for trace_fn in trace_fns:
+            if not sh.isfile(trace_fn):
+                self.forget(trace_fn)
+                am_pruned += 1
+        return am_pruned
+
+    def import_trace(self, trace_fn):
+        """Replaces what we know about the given (v1) trace with what is in it."""
+        component = component_of(trace_fn)
+        rows = list()
+        for (cmd, action) in tr.TraceReader(trace_fn).read():
+            if cmd == tr.TRACE_VERSION and action != str(tr.TRACE_VER):
+                msg = "Can not import trace %s with version %s (expected %s)" % (trace_fn, action, tr.TRACE_VER)
+                raise excp.FileException(msg)
+            if cmd in RECORDED_TYPES:
+                rows.append((component, trace_fn, cmd, action, path_of(cmd, action)))
+        with self.lock:
+            self.conn.execute("DELETE FROM events WHERE trace_fn = ?", (trace_fn,))
+            self.conn.executemany("INSERT INTO events (component, trace_fn, type, action, path)"
+                                  " VALUES (?, ?, ?, ?, ?)", rows)
+            self._mark_imported(trace_fn)
+            self.dirty.discard(trace_fn)
+            self.conn.commit()
+        return len(rows)
+
+    def import_root(self, root_dir):
+        """Imports all the component traces found in the given root directory."""
+        am_imported = 0
+        for (_, trace_fn) in tr.component_traces(root_dir):
+            am_imported += self.import_trace(trace_fn)
+        return am_imported
+
+    def refresh(self, root_dir):
+        """
+        Re-imports the component traces of the given root directory that were
+        changed (ie written to by a run that was not mirroring them) since we
+        last imported them. Returns how many traces were re-imported.
+        """
+        with self.lock:
+            known = dict()
+            for (trace_fn, mtime, size) in self.conn.execute("SELECT trace_fn, mtime, size FROM imports"):
+                known[trace_fn] = (mtime, size)
+        am_refreshed = 0
+        for (_, trace_fn) in tr.component_traces(root_dir):
+            if known.get(trace_fn) != self._stat(trace_fn):
+                LOG.debug("Re-importing the changed trace %s into the state database." % (trace_fn))
+                self.import_trace(trace_fn)
+                am_refreshed += 1
+        return am_refreshed
+
+    def _select(self, what, where, args):
+        sql = "SELECT %s FROM events" % (what)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def actions(self, cmd, component=None, trace_fn=None):
+        where = ["type = ?"]
+        args = [cmd]
+        if component is not None:
+            where.append("component = ?")
+            args.append(component)
+        if trace_fn is not None:
+            where.append("trace_fn = ?")
+            args.append(trace_fn)
+        return [row[0] for row in self._select("action", where, args)]
+
+    def components_with(self, path):
+        """Returns which components traced something about the given path."""
+        rows = self._select("DISTINCT component", ["path = ?"], [path])
+        return sorted([row[0] for row in rows if row[0]])
+
+    def apps_started(self):
+        """Returns the apps (by component) that were traced as started."""
+        started = dict()
+        for (component, action) in self._select("component, action", ["type = ?"], [tr.AP_STARTED]):
+            entry = json.loads(action)
+            if type(entry) is dict:
+                started.setdefault(component, list()).append(entry.get('name'))
+        return started
+
+
+def enable(root_dir):
+    """Starts mirroring traces into the state database of the given root directory."""
+    global _STORE
+    if _STORE is None:
+        db_fn = sh.joinpths(root_dir, STATE_FN)
+        LOG.debug("Mirroring traces into the state database at %s" % (db_fn))
+        existed = sh.isfile(db_fn)
+        store = StateStore(db_fn)
+        if not existed:
+            LOG.info("Importing existing traces from %s into the state database." % (root_dir))
+            store.import_root(root_dir)
+        else:
+            store.prune()
+            store.refresh(root_dir)
+        _STORE = store
+        tr.set_state_store(_STORE)
+    return _STORE
+
+
+def get_store():
+    return _STORE
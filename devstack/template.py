@@ -0,0 +1,178 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import re
+import threading
+
+from devstack import exceptions as excp
+from devstack import log as logging
+from devstack import settings
+from devstack import shell as sh
+
+LOG = logging.getLogger("devstack.template")
+
+# The pattern will match either a comment to the EOL, or a
+# token to be subbed. The replacer will check which it got and
+# act accordingly. Note that we need the MULTILINE flag
+# for the comment checks to work in a string containing newlines
+PARAM_SUB_REGEX = re.compile(r"#.*$|%([\w\d]+?)%", re.MULTILINE)
+
+# How many compiled templates (by text) we keep before starting over
+MAX_CACHED = 512
+
+_LOCK = threading.Lock()
+_BY_TEXT = dict()
+_BY_PATH = dict()
+_REGISTRY = None
+
+
+class Template(object):
+    """
+    A template split (once) into its literal pieces and the %PARAM% names
+    that go between them so that rendering it is a single join.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pieces = list()
+        self.params = list()
+        self.names = set()
+        start = 0
+        for match in PARAM_SUB_REGEX.finditer(text):
+            param_name = match.group(1)
+            # Comments (and any tokens in them) are kept as is
+            if param_name is None:
+                continue
+            self.pieces.append(text[start:match.start()])
+            self.params.append(param_name)
+            self.names.add(param_name)
+            start = match.end()
+        self.pieces.append(text[start:])
+
+    def missing(self, replacements):
+        return [name for name in self.params if replacements.get(name) is None]
+
+    def render(self, replacements, ignore_missing=False):
+        if not self.params:
+            return self.text
+        if not ignore_missing:
+            missing = self.missing(replacements)
+            if missing:
+                msg = "No replacement found for parameter %%%s%%" % (missing[0])
+                raise excp.NoReplacementException(msg)
+        output = list()
+        for (i, name) in enumerate(self.params):
+            output.append(self.pieces[i])
+            value = replacements.get(name)
+            if value is None:
+                output.append("%" + name + "%")
+            else:
+                output.append(str(value))
+        output.append(self.pieces[-1])
+        return "".join(output)
+
+
+def compile_template(text):
+    """Returns the (cached) template made from the given text."""
+    with _LOCK:
+        tpl = _BY_TEXT.get(text)
+    if tpl is None:
+        tpl = Template(text)
+        with _LOCK:
+            if len(_BY_TEXT) >= MAX_CACHED:
+                _BY_TEXT.clear()
+            _BY_TEXT[text] = tpl
+    return tpl
+
+
+def load(path):
+    """Returns the template in the given file (loaded again only when it changes)."""
+    mtime = sh.getmtime(path)
+    with _LOCK:
+        cached = _BY_PATH.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    tpl = compile_template(sh.load_file(path))
+    with _LOCK:
+        _BY_PATH[path] = (mtime, tpl)
+    return tpl
+
+
+class Registry(object):
+    """
+    Serves the templates of a template directory (ie conf/templates) from
+    memory. Files are checked for changes (by mtime) on each lookup and a
+    bundle (all the templates packed into one file) can be used instead of
+    reading each of them when it is newer than they are.
+    """
+
+    def __init__(self, template_dir, bundle_fn=None):
+        self.template_dir = template_dir
+        self.bundled = dict()
+        self.bundle_mtime = 0
+        if bundle_fn and sh.isfile(bundle_fn):
+            self.load_bundle(bundle_fn)
+
+    def names(self):
+        names = list()
+        for (dirpath, _, filenames) in os.walk(self.template_dir):
+            for fn in filenames:
+                names.append(os.path.relpath(sh.joinpths(dirpath, fn), self.template_dir))
+        names.sort()
+        return names
+
+    def preload(self):
+        names = self.names()
+        for name in names:
+            if name not in self.bundled:
+                load(sh.joinpths(self.template_dir, name))
+        LOG.debug("Preloaded %s templates from %s." % (len(names), self.template_dir))
+        return len(names)
+
+    def get(self, component, template_name):
+        """Returns the path of the given template and its compiled template."""
+        path = sh.joinpths(self.template_dir, component, template_name)
+        tpl = self.bundled.get(sh.joinpths(component, template_name))
+        if tpl is not None:
+            if not sh.isfile(path) or sh.getmtime(path) <= self.bundle_mtime:
+                return (path, tpl)
+        return (path, load(path))
+
+    def load_bundle(self, bundle_fn):
+        LOG.debug("Loading templates from bundle %s" % (bundle_fn))
+        contents = json.loads(sh.load_file(bundle_fn, quiet=True))
+        self.bundled = dict()
+        for (name, text) in contents.items():
+            self.bundled[name.encode('utf-8')] = compile_template(text.encode('utf-8'))
+        self.bundle_mtime = sh.getmtime(bundle_fn)
+        return len(self.bundled)
+
+    def write_bundle(self, bundle_fn):
+        contents = dict()
+        for name in self.names():
+            contents[name] = load(sh.joinpths(self.template_dir, name)).text
+        sh.write_file(bundle_fn, json.dumps(contents, sort_keys=True, indent=1), quiet=True)
+        return len(contents)
+
+
+def get_registry():
+    global _REGISTRY
+    with _LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = Registry(settings.STACK_TEMPLATE_DIR, settings.STACK_TEMPLATE_BUNDLE)
+        return _REGISTRY
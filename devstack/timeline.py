@@ -0,0 +1,140 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from devstack import log as logging
+
+LOG = logging.getLogger("devstack.timeline")
+
+# Chrome trace event phase type for a complete (start + duration) event
+# See: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+COMPLETE_EVENT = "X"
+
+# Event categories we record
+ACTION_CAT = "action"
+PHASE_CAT = "phase"
+CMD_CAT = "cmd"
+
+# Keep the (displayed) names of command events reasonably short
+MAX_NAME_LEN = 64
+
+# When none we are not recording
+_EVENTS = None
+_LOCK = threading.Lock()
+_THREAD_IDS = dict()
+_CONTEXT = threading.local()
+
+
+def enable():
+    global _EVENTS
+    with _LOCK:
+        if _EVENTS is None:
+            LOG.debug("Enabling timeline recording")
+            _EVENTS = list()
+
+
+def disable():
+    """Stops recording (and forgets what was recorded)."""
+    global _EVENTS
+    with _LOCK:
+        _EVENTS = None
+
+
+def is_enabled():
+    return _EVENTS is not None
+
+
+def _now(when=None):
+    # Trace events are in microseconds
+    if when is None:
+        when = time.time()
+    return int(when * 1000000)
+
+
+def _thread_id():
+    ident = threading.current_thread().ident
+    with _LOCK:
+        if ident not in _THREAD_IDS:
+            _THREAD_IDS[ident] = len(_THREAD_IDS) + 1
+        return _THREAD_IDS[ident]
+
+
+def _current_context():
+    stack = getattr(_CONTEXT, 'stack', None)
+    if not stack:
+        return dict()
+    return dict(stack[-1])
+
+
+def _add_event(name, category, start, end, event_args):
+    if len(name) > MAX_NAME_LEN:
+        name = name[0:MAX_NAME_LEN] + "..."
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': COMPLETE_EVENT,
+        'ts': start,
+        'dur': end - start,
+        'pid': os.getpid(),
+        'tid': _thread_id(),
+        'args': event_args,
+    }
+    with _LOCK:
+        if _EVENTS is not None:
+            _EVENTS.append(event)
+
+
+def record(name, category, started, finished, **args):
+    """Records something that was not timed with span() (times are from time.time())."""
+    if not is_enabled():
+        return
+    event_args = _current_context()
+    event_args.update(args)
+    _add_event(name, category, _now(started), _now(finished), event_args)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Records how long the wrapped block took (when recording is enabled)."""
+    if not is_enabled():
+        yield
+        return
+    event_args = _current_context()
+    event_args.update(args)
+    stack = getattr(_CONTEXT, 'stack', None)
+    if stack is None:
+        stack = list()
+        _CONTEXT.stack = stack
+    stack.append(event_args)
+    start = _now()
+    try:
+        yield
+    finally:
+        end = _now()
+        stack.pop()
+        _add_event(name, category, start, end, event_args)
+
+
+def dump():
+    """Returns the recorded events in the chrome trace event json format."""
+    with _LOCK:
+        events = sorted(list(_EVENTS or list()), key=lambda e: e['ts'])
+    return json.dumps({'traceEvents': events}, indent=1)
@@ -14,17 +14,23 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import json
 import os
+import threading
 
 from devstack import date
 from devstack import exceptions as excp
+from devstack import settings
 from devstack import shell as sh
 
 # Trace per line output format and file extension formats
 TRACE_FMT = ("%s - %s" + os.linesep)
 TRACE_EXT = ".trace"
 
+# Where (next to the traces) the full output of long running commands goes
+OUTPUT_EXT = ".log"
+
 # Common trace actions
 CFG_WRITING_FILE = "CFG_WRITING_FILE"
 SYMLINK_MAKE = "SYMLINK_MAKE"
@@ -32,34 +38,215 @@ PKG_INSTALL = "PKG_INSTALL"
 PYTHON_INSTALL = "PYTHON_INSTALL"
 DIR_MADE = "DIR_MADE"
 FILE_TOUCHED = "FILE_TOUCHED"
+FILE_REMOVED = "FILE_REMOVED"
 DOWNLOADED = "DOWNLOADED"
 AP_STARTED = "AP_STARTED"
 PIP_INSTALL = 'PIP_INSTALL'
+PHASE_DONE = 'PHASE_DONE'
+CFG_FILE_HASH = 'CFG_FILE_HASH'
 
 # Common trace file types (or the expected common ones)
 PY_TRACE = "python"
 IN_TRACE = "install"
 START_TRACE = "start"
+JOURNAL_TRACE = "journal"
 
 # Used to note version of trace
 TRACE_VERSION = "TRACE_VERSION"
 TRACE_VER = 0x1
 
+# Traces that are continued once they are bigger than this (in bytes) are
+# first compacted (see compact below)
+COMPACT_SIZE = 512 * 1024
+
+# When compacting duplicates of these are dropped (the first one is kept)
+COMPACT_DEDUPED = [CFG_WRITING_FILE, SYMLINK_MAKE, PKG_INSTALL, PYTHON_INSTALL,
+                   DIR_MADE, FILE_TOUCHED, FILE_REMOVED, DOWNLOADED, PIP_INSTALL,
+                   TRACE_VERSION]
+
+# When compacting only the last of these (with the same json key values) is kept
+COMPACT_LAST_WINS = {
+    AP_STARTED: ['name'],
+    PHASE_DONE: ['action', 'phase'],
+    CFG_FILE_HASH: ['fn'],
+}
+
+# Buffered writers write out their lines once they have this many
+BUFFER_LINES = 128
+
+# How buffered writers make their lines durable when they are synced
+SYNC_FLUSH = "flush"
+SYNC_FSYNC = "fsync"
+SYNC_MODES = [SYNC_FLUSH, SYNC_FSYNC]
+_SYNC_MODE = SYNC_FLUSH
+
+# When set trace entries are also recorded into this (state) store
+_STATE_STORE = None
+
+# The buffered writers that have unsynced lines (so they can be synced together)
+_OPEN_WRITERS = set()
+_OPEN_LOCK = threading.Lock()
+
+
+def set_sync_mode(mode):
+    global _SYNC_MODE
+    if mode not in SYNC_MODES:
+        msg = "Unknown trace sync mode %r (expected one of %s)" % (mode, ", ".join(SYNC_MODES))
+        raise excp.ConfigException(msg)
+    _SYNC_MODE = mode
+
+
+def _compact_key(cmd, action):
+    if cmd in COMPACT_DEDUPED:
+        return (cmd, action)
+    if cmd in COMPACT_LAST_WINS:
+        try:
+            entry = json.loads(action)
+        except ValueError:
+            return None
+        if type(entry) is dict:
+            return (cmd, tuple([entry.get(k) for k in COMPACT_LAST_WINS[cmd]]))
+    return None
+
+
+def compact(trace_filename):
+    """
+    Rewrites the given trace into its smallest equivalent (duplicate entries
+    are dropped and only the last start of an app is kept), the rewritten
+    trace replaces the old one atomically. Returns how many lines there were
+    before and after.
+    """
+    reader = TraceReader(trace_filename)
+    firsts = dict()
+    lasts = dict()
+    total = 0
+    for (i, (cmd, action)) in enumerate(reader.read()):
+        total += 1
+        key = _compact_key(cmd, action)
+        if key is None:
+            continue
+        if cmd in COMPACT_LAST_WINS:
+            lasts[key] = i
+        elif key not in firsts:
+            firsts[key] = i
+    lines = list()
+    for (i, (cmd, action)) in enumerate(reader.read()):
+        key = _compact_key(cmd, action)
+        if key is not None:
+            if cmd in COMPACT_LAST_WINS and lasts[key] != i:
+                continue
+            if cmd not in COMPACT_LAST_WINS and firsts[key] != i:
+                continue
+        lines.append(TRACE_FMT % (cmd, action))
+    if len(lines) != total and not sh.DRYRUN_MODE:
+        # Written next to the old trace then renamed over it so that readers
+        # see either the old or the new trace (never a partial one)
+        tmp_fn = "%s.compact" % (trace_filename)
+        with sh.Rooted._lock:
+            with open(tmp_fn, "w") as fh:
+                fh.write("".join(lines))
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.rename(tmp_fn, trace_filename)
+        if _STATE_STORE is not None:
+            _STATE_STORE.import_trace(trace_filename)
+    return (total, len(lines))
+
+
+def set_state_store(store):
+    global _STATE_STORE
+    _STATE_STORE = store
+
+
+def sync_all():
+    """Writes out (and closes) every buffered writer that has unsynced lines."""
+    with _OPEN_LOCK:
+        writers = list(_OPEN_WRITERS)
+    for writer in writers:
+        writer.sync()
+    if _STATE_STORE is not None:
+        _STATE_STORE.commit()
+
 
 def trace_fn(root_dir, name):
     return sh.joinpths(root_dir, name + TRACE_EXT)
 
 
+def output_fn(root_dir, name):
+    return sh.joinpths(root_dir, name + OUTPUT_EXT)
+
+
+def journal_fn(root_dir, action):
+    return trace_fn(root_dir, "%s-%s" % (JOURNAL_TRACE, action))
+
+
+def component_traces(root_dir):
+    """Returns (component, trace filename) for the traces in a root directory."""
+    traces = list()
+    for component in sorted(sh.listdir(root_dir)):
+        trace_dir = sh.joinpths(root_dir, component, settings.COMPONENT_TRACE_DIR)
+        if not sh.isdir(trace_dir):
+            continue
+        for fn in sorted(sh.listdir(trace_dir)):
+            if fn.endswith(TRACE_EXT):
+                traces.append((component, sh.joinpths(trace_dir, fn)))
+    return traces
+
+
 class TraceWriter(object):
-    def __init__(self, trace_filename):
+    def __init__(self, trace_filename, break_if_there=True, buffered=False):
         self.trace_fn = trace_filename
+        self.break_if_there = break_if_there
         self.started = False
+        # When buffered we keep the file open and write out lines in batches
+        # (when the buffer fills up or when synced, ie at the end of a phase)
+        self.buffered = buffered
+        self.buffer = list()
+        self.fh = None
+        self.lock = threading.RLock()
 
     def trace(self, cmd, action=None):
         if action is None:
             action = date.rcf8222date()
-        if cmd is not None:
-            sh.append_file(self.trace_fn, TRACE_FMT % (cmd, action))
+        if cmd is None:
+            return
+        line = TRACE_FMT % (cmd, action)
+        if _STATE_STORE is not None:
+            _STATE_STORE.record(self.trace_fn, cmd, action)
+        if not self.buffered:
+            sh.append_file(self.trace_fn, line)
+            return
+        with self.lock:
+            if not self.buffer and self.fh is None:
+                with _OPEN_LOCK:
+                    _OPEN_WRITERS.add(self)
+            self.buffer.append(line)
+            if len(self.buffer) >= BUFFER_LINES:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        if not self.buffer or sh.DRYRUN_MODE:
+            self.buffer = list()
+            return
+        if self.fh is None:
+            with sh.Rooted._lock:
+                self.fh = open(self.trace_fn, "a")
+        # Only whole lines get written so readers never see a partial entry
+        # unless we died in the middle of this write
+        self.fh.write("".join(self.buffer))
+        self.fh.flush()
+        self.buffer = list()
+
+    def sync(self):
+        with self.lock:
+            self._write_buffer()
+            if self.fh is not None:
+                if _SYNC_MODE == SYNC_FSYNC:
+                    os.fsync(self.fh.fileno())
+                self.fh.close()
+                self.fh = None
+            with _OPEN_LOCK:
+                _OPEN_WRITERS.discard(self)
 
     def filename(self):
         return self.trace_fn
@@ -67,7 +254,18 @@ class TraceWriter(object):
     def _start(self):
         if self.started:
             return
+        elif sh.isfile(self.trace_fn):
+            if self.break_if_there:
+                msg = "Can not start a new trace at %s since one already exists" % (self.trace_fn)
+                raise excp.FileException(msg)
+            # Continue on from where the existing trace left off
+            if sh.getsize(self.trace_fn) > COMPACT_SIZE:
+                compact(self.trace_fn)
+            self.started = True
         else:
+            if _STATE_STORE is not None:
+                # Anything known about a previous trace here is now stale
+                _STATE_STORE.forget(self.trace_fn)
             trace_dirs = sh.mkdirslist(sh.dirname(self.trace_fn))
             sh.touch_file(self.trace_fn)
             self.trace(TRACE_VERSION, str(TRACE_VER))
@@ -81,9 +279,17 @@ class TraceWriter(object):
         what['where'] = where
         self.trace(PYTHON_INSTALL, json.dumps(what))
 
-    def cfg_file_written(self, fn):
+    def cfg_file_written(self, fn, contents=None, status=None):
         self._start()
         self.trace(CFG_WRITING_FILE, fn)
+        if contents is not None:
+            # Used to tell if the file was changed after we wrote it
+            what = dict()
+            what['fn'] = fn
+            what['md5'] = hashlib.md5(contents).hexdigest()
+            if status:
+                what['status'] = status
+            self.trace(CFG_FILE_HASH, json.dumps(what))
 
     def symlink_made(self, link):
         self._start()
@@ -109,10 +315,24 @@ class TraceWriter(object):
         self._start()
         self.trace(FILE_TOUCHED, fn)
 
+    def file_removed(self, fn):
+        # A file that we made (ie a config) that was later removed on purpose
+        self._start()
+        self.trace(FILE_REMOVED, fn)
+
     def package_installed(self, pkg_info):
         self._start()
         self.trace(PKG_INSTALL, json.dumps(pkg_info))
 
+    def phase_completed(self, action, phase, fingerprint, inputs=None):
+        self._start()
+        what = dict()
+        what['action'] = action
+        what['phase'] = phase
+        what['fingerprint'] = fingerprint
+        what['inputs'] = inputs
+        self.trace(PHASE_DONE, json.dumps(what))
+
     def started_info(self, name, info_fn):
         self._start()
         data = dict()
@@ -122,32 +342,57 @@ class TraceWriter(object):
 
 
 class TraceReader(object):
+    """
+    Reads the entries of a trace. Only actions() and components_with() go
+    through the state store (when one is enabled), every other accessor reads
+    the trace file itself so they also work for traces the store never saw.
+    """
+
     def __init__(self, trace_filename):
         self.trace_fn = trace_filename
-        self.contents = None
+        # Trace type -> actions (in the order they were traced)
+        self.index = None
+        # Trace type -> json decoded actions (decoded when first asked for)
+        self.decoded = dict()
 
     def filename(self):
         return self.trace_fn
 
-    def _parse(self):
+    def _iter_entries(self):
+        # Streamed a line at a time so we never have the whole file in memory
+        for line in sh.iter_file_lines(self.trace_fn, quiet=True):
+            if not line.endswith(os.linesep):
+                # A partial line left by a writer that died while writing
+                continue
+            ep = self._split_line(line[0:-len(os.linesep)])
+            if ep is not None:
+                yield ep
+
+    def read(self):
+        """Iterates over the (type, action) entries of the trace (in the order they were traced)."""
         fn = self.trace_fn
         if not sh.isfile(fn):
             msg = "No trace found at filename %s" % (fn)
             raise excp.NoTraceException(msg)
-        contents = sh.load_file(fn)
-        lines = contents.splitlines()
-        accum = list()
-        for line in lines:
-            ep = self._split_line(line)
-            if ep is None:
-                continue
-            accum.append(tuple(ep))
-        return accum
-
-    def read(self):
-        if self.contents is None:
-            self.contents = self._parse()
-        return self.contents
+        return self._iter_entries()
+
+    def _actions(self, cmd):
+        if self.index is None:
+            index = dict()
+            for (entry_cmd, action) in self.read():
+                index.setdefault(entry_cmd, list()).append(action)
+            self.index = index
+        return [action for action in self.index.get(cmd, list()) if len(action)]
+
+    def _entries(self, cmd):
+        if cmd not in self.decoded:
+            entries = list()
+            for action in self._actions(cmd):
+                entry = json.loads(action)
+                if type(entry) is dict:
+                    entries.append(entry)
+            self.decoded[cmd] = entries
+        return self.decoded[cmd]
 
     def _split_line(self, line):
         pieces = line.split("-", 1)
@@ -161,25 +406,24 @@ class TraceReader(object):
     def exists(self):
         return sh.exists(self.trace_fn)
 
+    def actions(self, cmd):
+        """Returns the actions of the given type (from the state store if there is one)."""
+        if _STATE_STORE is not None:
+            return _STATE_STORE.actions(cmd, trace_fn=self.trace_fn)
+        return self._actions(cmd)
+
+    def components_with(self, path):
+        """Returns which components traced the given path (needs a state store)."""
+        if _STATE_STORE is None:
+            msg = "No state store to look up which components traced %s" % (path)
+            raise excp.NoTraceException(msg)
+        return _STATE_STORE.components_with(path)
+
     def py_listing(self):
-        lines = self.read()
-        py_entries = list()
-        for (cmd, action) in lines:
-            if cmd == PYTHON_INSTALL and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    py_entries.append((entry.get("name"), entry.get("where")))
-        return py_entries
+        return [(entry.get("name"), entry.get("where")) for entry in self._entries(PYTHON_INSTALL)]
 
     def download_locations(self):
-        lines = self.read()
-        locations = list()
-        for (cmd, action) in lines:
-            if cmd == DOWNLOADED and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    locations.append((entry.get('target'), entry.get('uri')))
-        return locations
+        return [(entry.get('target'), entry.get('uri')) for entry in self._entries(DOWNLOADED)]
 
     def _sort_paths(self, pths):
         # Ensure in correct order (ie /tmp is before /)
@@ -189,71 +433,46 @@ class TraceReader(object):
         return pths
 
     def files_touched(self):
-        lines = self.read()
-        files = list()
-        for (cmd, action) in lines:
-            if cmd == FILE_TOUCHED and len(action):
-                files.append(action)
-        return self._sort_paths(files)
+        return self._sort_paths(self._actions(FILE_TOUCHED))
 
     def dirs_made(self):
-        lines = self.read()
-        dirs = list()
-        for (cmd, action) in lines:
-            if cmd == DIR_MADE and len(action):
-                dirs.append(action)
-        return self._sort_paths(dirs)
+        return self._sort_paths(self._actions(DIR_MADE))
+
+    def files_removed(self):
+        files = list(set(self._actions(FILE_REMOVED)))
+        files.sort()
+        return files
 
     def apps_started(self):
-        lines = self.read()
-        app_info = list()
-        for (cmd, action) in lines:
-            if cmd == AP_STARTED and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    app_info.append((entry.get('trace_fn'), entry.get('name')))
-        return app_info
+        return [(entry.get('trace_fn'), entry.get('name')) for entry in self._entries(AP_STARTED)]
 
     def symlinks_made(self):
-        lines = self.read()
-        links = list()
-        for (cmd, action) in lines:
-            if cmd == SYMLINK_MAKE and len(action):
-                links.append(action)
-        return links
+        return self._actions(SYMLINK_MAKE)
 
     def files_configured(self):
-        lines = self.read()
-        files = list()
-        for (cmd, action) in lines:
-            if cmd == CFG_WRITING_FILE and len(action):
-                files.append(action)
-        files = list(set(files))
+        files = list(set(self._actions(CFG_WRITING_FILE)))
         files.sort()
         return files
 
+    def files_configured_hashes(self):
+        # The last hash of a file is what it should have now
+        hashes = dict()
+        for entry in self._entries(CFG_FILE_HASH):
+            hashes[entry.get('fn')] = entry.get('md5')
+        return hashes
+
+    def files_configured_changed(self):
+        # Files whose last write was not skipped (ie something may need a restart)
+        statuses = dict()
+        for entry in self._entries(CFG_FILE_HASH):
+            statuses[entry.get('fn')] = entry.get('status')
+        return sorted([fn for (fn, status) in statuses.items() if status != sh.FILE_UNCHANGED])
+
     def pips_installed(self):
-        lines = self.read()
-        pips_installed = list()
-        pip_list = list()
-        for (cmd, action) in lines:
-            if cmd == PIP_INSTALL and len(action):
-                pip_list.append(action)
-        for pip_data in pip_list:
-            pip_info_full = json.loads(pip_data)
-            if type(pip_info_full) is dict:
-                pips_installed.append(pip_info_full)
-        return pips_installed
+        return list(self._entries(PIP_INSTALL))
 
     def packages_installed(self):
-        lines = self.read()
-        pkgs_installed = list()
-        pkg_list = list()
-        for (cmd, action) in lines:
-            if cmd == PKG_INSTALL and len(action):
-                pkg_list.append(action)
-        for pkg_data in pkg_list:
-            pkg_info = json.loads(pkg_data)
-            if type(pkg_info) is dict:
-                pkgs_installed.append(pkg_info)
-        return pkgs_installed
+        return list(self._entries(PKG_INSTALL))
+
+    def phases_completed(self):
+        return list(self._entries(PHASE_DONE))
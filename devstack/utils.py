@@ -31,17 +31,12 @@ import progressbar
 import termcolor
 
 from devstack import colorlog
-from devstack import exceptions as excp
 from devstack import log as logging
 from devstack import settings
 from devstack import shell as sh
+from devstack import template
 from devstack import version
 
-# The pattern will match either a comment to the EOL, or a
-# token to be subbed. The replacer will check which it got and
-# act accordingly. Note that we need the MULTILINE flag
-# for the comment checks to work in a string containing newlines
-PARAM_SUB_REGEX = re.compile(r"#.*$|%([\w\d]+?)%", re.MULTILINE)
 EXT_COMPONENT = re.compile(r"^\s*([\w-]+)(?:\((.*)\))?\s*$")
 MONTY_PYTHON_TEXT_RE = re.compile("([a-z0-9A-Z\?!.,'\"]+)")
 LOG = logging.getLogger("devstack.util")
@@ -99,9 +94,8 @@ def configure_logging(verbosity_level=1, dry_run=False):
 
 
 def load_template(component, template_name):
-    full_pth = sh.joinpths(settings.STACK_TEMPLATE_DIR, component, template_name)
-    contents = sh.load_file(full_pth)
-    return (full_pth, contents)
+    (full_pth, tpl) = template.get_registry().get(component, template_name)
+    return (full_pth, tpl.text)
 
 
 def execute_template(*cmds, **kargs):
@@ -305,63 +299,17 @@ def param_replace_list(values, replacements, ignore_missing=False):
 
 
 def find_params(text):
-    params_found = set()
     if not text:
-        return params_found
-
-    def finder(match):
-        org_txt = match.group(0)
-        # Check if it's a comment, if so just return what it was and ignore
-        # any tokens that were there
-        if org_txt.startswith("#"):
-            return org_txt
-        param_name = match.group(1)
-        if param_name not in params_found:
-            params_found.add(param_name)
-        return org_txt
-
-    PARAM_SUB_REGEX.sub(finder, text)
-    return params_found
+        return set()
+    return set(template.compile_template(text).names)
 
 
 def param_replace(text, replacements, ignore_missing=False):
-
     if not replacements:
         replacements = dict()
-
     if not text:
         return ""
-
-    if ignore_missing:
-        LOG.debug("Performing parameter replacements (ignoring missing) on text [%s]" % (text))
-    else:
-        LOG.debug("Performing parameter replacements (not ignoring missing) on text [%s]" % (text))
-
-    possible_params = find_params(text)
-    LOG.debug("Possible replacements are [%s]" % (", ".join(possible_params)))
-
-    def replacer(match):
-        org_txt = match.group(0)
-        param_name = match.group(1)
-        # Check if it's a comment, if so just return what it was and ignore
-        # any tokens that were there
-        if org_txt.startswith('#'):
-            LOG.debug("Ignoring comment line")
-            return org_txt
-        replacer = replacements.get(param_name)
-        if replacer is None and ignore_missing:
-            replacer = org_txt
-        elif replacer is None and not ignore_missing:
-            msg = "No replacement found for parameter %s" % (org_txt)
-            raise excp.NoReplacementException(msg)
-        else:
-            replacer = str(replacer)
-            LOG.debug("Replacing [%s] with [%s]" % (org_txt, replacer))
-        return replacer
-
-    replaced_text = PARAM_SUB_REGEX.sub(replacer, text)
-    LOG.debug("Replacement/s resulted in text [%s]" % (replaced_text))
-    return replaced_text
+    return template.compile_template(text).render(replacements, ignore_missing)
 
 
 def _get_welcome_stack():
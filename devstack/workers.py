@@ -0,0 +1,164 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import Queue
+import sys
+import threading
+
+from devstack import exceptions as excp
+from devstack import log as logging
+
+LOG = logging.getLogger("devstack.workers")
+
+# How long (in seconds) we block waiting for a worker to finish before checking
+# again, this keeps the main thread responsive to signals (ie ctrl-c).
+WAIT_TIMEOUT = 0.25
+
+
+def topological_order(order, dependencies):
+    """
+    Returns the nodes in order sorted so that each node comes after all of
+    its dependencies, preferring the ordering given by order whenever
+    there is a choice. Dependencies on nodes not in order are ignored.
+    """
+    known = set(order)
+    remaining = list(order)
+    done = set()
+    sorted_nodes = list()
+    while remaining:
+        for node in remaining:
+            deps = set(dependencies.get(node) or list()) & known
+            if deps.issubset(done):
+                remaining.remove(node)
+                done.add(node)
+                sorted_nodes.append(node)
+                break
+        else:
+            msg = "Dependency cycle detected between (%s)" % (", ".join([str(n) for n in remaining]))
+            raise excp.DependencyException(msg)
+    return sorted_nodes
+
+
+def invert_dependencies(order, dependencies):
+    """Returns a new dependency map where each node depends on its dependents."""
+    inverted = dict()
+    for node in order:
+        inverted[node] = set()
+    for node in order:
+        for dep in (dependencies.get(node) or list()):
+            if dep in inverted:
+                inverted[dep].add(node)
+    return inverted
+
+
+def run_graph(order, dependencies, functor, max_workers=1):
+    """
+    Calls functor(node) for each node in order, never before all of that
+    nodes dependencies have finished. At most max_workers calls will be active
+    at any given time. When one call fails no further nodes are started, the
+    active calls are allowed to finish and the first failure is re-raised.
+    """
+    sorted_nodes = topological_order(order, dependencies)
+    if max_workers <= 1 or len(sorted_nodes) <= 1:
+        for node in sorted_nodes:
+            functor(node)
+        return
+    known = set(sorted_nodes)
+    results = Queue.Queue()
+
+    def run_node(node):
+        try:
+            functor(node)
+            results.put((node, None))
+        except Exception:
+            results.put((node, sys.exc_info()))
+
+    pending = list(sorted_nodes)
+    done = set()
+    active = 0
+    failure = None
+    while pending or active:
+        if failure is None:
+            for node in list(pending):
+                if active >= max_workers:
+                    break
+                deps = set(dependencies.get(node) or list()) & known
+                if deps.issubset(done):
+                    pending.remove(node)
+                    LOG.debug("Starting worker for %r (%s active)" % (node, active + 1))
+                    worker = threading.Thread(target=run_node, args=(node,),
+                                              name="worker-%s" % (str(node)))
+                    worker.daemon = True
+                    worker.start()
+                    active += 1
+        if not active:
+            break
+        try:
+            (node, exc_info) = results.get(True, WAIT_TIMEOUT)
+        except Queue.Empty:
+            continue
+        active -= 1
+        if exc_info is not None:
+            if failure is None:
+                LOG.debug("Worker for %r failed, waiting on %s active workers" % (node, active))
+                failure = exc_info
+        else:
+            done.add(node)
+    if failure is not None:
+        raise failure[0], failure[1], failure[2]
+
+
+def map_pool(functor, items, max_workers=1):
+    """
+    Returns functor(item) for each of the items (in the same order) using up
+    to max_workers threads, the first failure (if any) is re-raised once the
+    active calls have finished.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if max_workers <= 1 or len(items) <= 1:
+        for (i, item) in enumerate(items):
+            results[i] = functor(item)
+        return results
+    todo = Queue.Queue()
+    for i in range(0, len(items)):
+        todo.put(i)
+    failures = list()
+
+    def run_items():
+        while not failures:
+            try:
+                i = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = functor(items[i])
+            except Exception:
+                failures.append(sys.exc_info())
+
+    threads = list()
+    for i in range(0, min(max_workers, len(items))):
+        worker = threading.Thread(target=run_items, name="pool-%s" % (i))
+        worker.daemon = True
+        worker.start()
+        threads.append(worker)
+    for worker in threads:
+        while worker.is_alive():
+            worker.join(WAIT_TIMEOUT)
+    if failures:
+        failure = failures[0]
+        raise failure[0], failure[1], failure[2]
+    return results
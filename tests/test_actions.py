@@ -0,0 +1,219 @@
+import threading
+
+from devstack import distro
+from devstack import exceptions as excp
+from devstack import settings
+from devstack import shell as sh
+from devstack import utils
+
+from devstack.progs import actions
+
+COMPONENTS = ['a', 'b', 'c']
+PHASES = [p[0] for p in actions.INSTALL_ORDERING]
+
+
+class FakeInstance(object):
+    def __init__(self, name, happened, lock, trace_dir, broken=False,
+                 untraced=False):
+        self.name = name
+        self.untraced = untraced
+        self.happened = happened
+        self.lock = lock
+        self.trace_dir = trace_dir
+        self.broken = broken
+        self.inputs = dict()
+        self.packages_batched = False
+        self.pips = list()
+        self.batch_pre_installed = False
+        self.download_waits_on = None
+
+    def _record(self, phase):
+        with self.lock:
+            self.happened.append((self.name, phase))
+
+    def phase_inputs(self, phase):
+        return self.inputs.get(phase)
+
+    def batch_packages(self):
+        return [{'name': 'pkg-%s' % (self.name)}, {'name': 'common'}]
+
+    def batch_pips(self):
+        return self.pips
+
+    def batch_pre_install(self):
+        self.batch_pre_installed = True
+
+    def download(self):
+        if self.download_waits_on is not None:
+            # Only finishes once the batch install ran (or gives up)
+            if not self.download_waits_on.wait(5):
+                self._record('download_timeout')
+        self._record('download')
+
+    def configure(self):
+        self._record('configure')
+
+    def pre_install(self):
+        self._record('pre_install')
+
+    def install(self):
+        if self.broken:
+            raise IOError("Broken install of %s" % (self.name))
+        self._record('install')
+
+    def post_install(self):
+        if self.untraced:
+            raise excp.NoTraceException("No trace found for %s" % (self.name))
+        self._record('post_install')
+
+
+class FakePackager(object):
+    def __init__(self):
+        self.batches = list()
+        self.installed = threading.Event()
+
+    def install_batch(self, pkgs, progress_cb=None, output_fn=None):
+        self.batches.append(sorted(set([p['name'] for p in pkgs])))
+        self.installed.set()
+
+
+def _run_install(root_dir, parallel=1, resume=False, broken=None,
+                 converge=False, inputs=None, untraced=None, packager=None,
+                 pips=None, slow_download=None):
+    d = distro.Distro('fake', 'ignore', 'apt', {},
+                      {'a': {},
+                       'b': {'dependencies': ['a']},
+                       'c': {},
+                       })
+    runner = actions.ActionRunner(d, settings.INSTALL, None, None,
+                                  packager or FakePackager(),
+                                  parallel=parallel, resume=resume,
+                                  converge=converge, force=True)
+    happened = list()
+    lock = threading.Lock()
+    instances = dict()
+    fingerprints = dict()
+    for name in COMPONENTS:
+        instances[name] = FakeInstance(name, happened, lock,
+                                       sh.joinpths(root_dir, name),
+                                       broken=(name == broken),
+                                       untraced=(name == untraced))
+        instances[name].inputs = dict(inputs or dict())
+        instances[name].pips = (pips or dict()).get(name, list())
+        if name == slow_download:
+            instances[name].download_waits_on = runner.pkg_manager.installed
+        fingerprints[name] = name
+    runner.fingerprints[settings.INSTALL] = fingerprints
+    runner._open_journals(settings.INSTALL, COMPONENTS, instances)
+    try:
+        runner._run_instances(settings.INSTALL, COMPONENTS, instances)
+    except IOError:
+        if not broken:
+            raise
+    return happened
+
+
+def test_serial_install_order():
+    with utils.tempdir() as root_dir:
+        happened = _run_install(root_dir)
+    expected = list()
+    for phase in PHASES:
+        for name in COMPONENTS:
+            expected.append((name, phase))
+    assert happened == expected
+
+
+def test_pipelined_install_order():
+    with utils.tempdir() as root_dir:
+        happened = _run_install(root_dir, parallel=3)
+    assert len(happened) == len(COMPONENTS) * len(PHASES)
+    for name in COMPONENTS:
+        mine = [phase for (who, phase) in happened if who == name]
+        assert mine == PHASES
+    for phase in PHASES[1:]:
+        assert happened.index(('a', phase)) < happened.index(('b', phase))
+
+
+def test_resume_install():
+    with utils.tempdir() as root_dir:
+        first = _run_install(root_dir, broken='b')
+        assert ('c', 'install') not in first
+        second = _run_install(root_dir, resume=True)
+        assert second == [('b', 'install'), ('c', 'install'),
+                          ('a', 'post_install'), ('b', 'post_install'),
+                          ('c', 'post_install')]
+        third = _run_install(root_dir)
+        assert len(third) == len(COMPONENTS) * len(PHASES)
+
+
+def test_converge_install():
+    inputs = {'download': 'v1', 'install': 'pkgs'}
+    with utils.tempdir() as root_dir:
+        first = _run_install(root_dir, converge=True, inputs=inputs)
+        assert len(first) == len(COMPONENTS) * len(PHASES)
+        # Phases without inputs always run again
+        second = _run_install(root_dir, converge=True, inputs=inputs)
+        for name in COMPONENTS:
+            mine = [phase for (who, phase) in second if who == name]
+            assert mine == ['configure', 'pre_install', 'post_install']
+        inputs['download'] = 'v2'
+        third = _run_install(root_dir, converge=True, inputs=inputs)
+        assert ('a', 'download') in third
+        assert ('a', 'install') not in third
+
+
+def test_resume_skipped_phase():
+    with utils.tempdir() as root_dir:
+        first = _run_install(root_dir, untraced='c')
+        assert ('c', 'post_install') not in first
+        second = _run_install(root_dir, resume=True)
+        assert second == [('c', 'post_install')]
+
+
+def test_batch_install():
+    for parallel in [1, 3]:
+        packager = FakePackager()
+        with utils.tempdir() as root_dir:
+            happened = _run_install(root_dir, parallel=parallel, packager=packager)
+        assert packager.batches == [['common', 'pkg-a', 'pkg-b', 'pkg-c']]
+        assert len(happened) == len(COMPONENTS) * len(PHASES)
+
+
+def test_batch_install_during_downloads():
+    packager = FakePackager()
+    with utils.tempdir() as root_dir:
+        happened = _run_install(root_dir, parallel=3, packager=packager, slow_download='a')
+    # The download of a waited for the batch (instead of the other way around)
+    assert ('a', 'download_timeout') not in happened
+    assert packager.batches == [['common', 'pkg-a', 'pkg-b', 'pkg-c']]
+    assert happened.index(('a', 'download')) < happened.index(('a', 'pre_install'))
+
+
+def test_batch_pip_conflict():
+    pips = {'a': [{'name': 'x', 'version': '1.0'}],
+            'c': [{'name': 'x', 'version': '2.0'}]}
+    for parallel in [1, 3]:
+        packager = FakePackager()
+        with utils.tempdir() as root_dir:
+            try:
+                _run_install(root_dir, parallel=parallel, packager=packager, pips=pips)
+                assert False, "Conflict not detected"
+            except excp.DependencyException:
+                pass
+        # Nothing got installed for anyone
+        assert packager.batches == []
+
+
+class FakeConfig(object):
+    def getdefaulted(self, section, option, default):
+        if (section, option) == ('git', 'download_workers'):
+            return 4
+        return default
+
+
+def test_download_workers_follow_parallel():
+    d = distro.Distro('fake', 'ignore', 'apt', {}, {})
+    runner = actions.ActionRunner(d, settings.INSTALL, FakeConfig(), None, None, parallel=1)
+    assert runner.download_workers == 1
+    runner = actions.ActionRunner(d, settings.INSTALL, FakeConfig(), None, None, parallel=2)
+    assert runner.download_workers == 4
@@ -0,0 +1,68 @@
+import os
+
+from devstack import cfg
+from devstack import env
+from devstack import exceptions as excp
+from devstack import shell as sh
+from devstack import utils
+
+CONF = """
+[a]
+x = ${CFG_TEST_X:-http://$(b:y):$(b:z)}
+w = raw $(b:y)
+
+[b]
+y = ${CFG_TEST_Y:-$(c:v)}
+z = 80
+
+[c]
+v = ${CFG_TEST_V:-here}
+"""
+
+
+def _load(contents):
+    with utils.tempdir() as tdir:
+        fn = sh.write_file(sh.joinpths(tdir, 'stack.ini'), contents)
+        return cfg.get_config(fn)
+
+
+def test_compiled():
+    config = _load(CONF)
+    assert config.compiled['a/x'] == 'http://here:80'
+    assert config.get('a', 'x') == 'http://here:80'
+    assert config.get('a', 'w') == 'raw $(b:y)'
+    assert sorted(config.configs_fetched.keys()) == ['a/w', 'a/x']
+
+
+def test_set_invalidates():
+    config = _load(CONF)
+    config.set('c', 'v', 'there')
+    assert config.get('a', 'x') == 'http://there:80'
+
+
+def test_cycle():
+    contents = CONF + "\n[d]\nm = ${CFG_TEST_M:-$(d:n)}\nn = ${CFG_TEST_N:-$(d:m)}\n"
+    try:
+        _load(contents)
+        assert False, "Cycle not detected"
+    except excp.ConfigException:
+        pass
+
+
+def test_cache():
+    with utils.tempdir() as tdir:
+        fn = sh.write_file(sh.joinpths(tdir, 'stack.ini'), CONF)
+        cache_fn = sh.joinpths(tdir, cfg.CACHE_FN)
+        config = cfg.get_config(fn, cache_fn=cache_fn)
+        assert sh.isfile(cache_fn)
+        # Make sure the next load comes from the cache
+        sh.write_file(cache_fn, sh.load_file(cache_fn).replace('http://here:80', 'cached'))
+        config = cfg.get_config(fn, cache_fn=cache_fn)
+        assert config.get('a', 'x') == 'cached'
+        assert type(config.get('a', 'x')) is str
+        env.set('CFG_TEST_V', 'else')
+        try:
+            config = cfg.get_config(fn, cache_fn=cache_fn)
+        finally:
+            del os.environ['CFG_TEST_V']
+        assert config.get('a', 'x') == 'http://else:80'
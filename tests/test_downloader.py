@@ -0,0 +1,150 @@
+import time
+
+from devstack import distro
+from devstack import downloader as down
+from devstack import exceptions as excp
+from devstack import shell as sh
+from devstack import utils
+from devstack import workers
+
+
+class FakeDownloader(down.Downloader):
+    def __init__(self, uri, broken=False):
+        down.Downloader.__init__(self, uri, uri)
+        self.broken = broken
+
+    def download(self):
+        if self.broken:
+            raise IOError("Broken download of %s" % (self.uri))
+        return [self.store_where]
+
+
+def test_download_manager():
+    finished = list()
+    manager = down.DownloadManager(3)
+    downloads = [(uri, FakeDownloader(uri), finished.extend) for uri in ['a', 'b', 'c']]
+    assert manager.run(downloads) == 3
+    assert sorted(finished) == ['a', 'b', 'c']
+
+
+def test_download_manager_failures():
+    finished = list()
+    manager = down.DownloadManager(2)
+    downloads = [(uri, FakeDownloader(uri, broken=(uri != 'b')), finished.extend)
+                 for uri in ['a', 'b', 'c']]
+    try:
+        manager.run(downloads)
+        assert False, "Failures not raised"
+    except excp.DownloadException as e:
+        assert 'a' in str(e) and 'c' in str(e)
+    assert finished == ['b']
+
+
+class SlowDownloader(FakeDownloader):
+    def __init__(self, uri, active, peaks):
+        FakeDownloader.__init__(self, uri)
+        self.active = active
+        self.peaks = peaks
+
+    def download(self):
+        self.active.append(self.uri)
+        self.peaks.append(len(self.active))
+        time.sleep(0.02)
+        self.active.remove(self.uri)
+        return FakeDownloader.download(self)
+
+
+def test_download_manager_shared():
+    active = list()
+    peaks = list()
+    manager = down.DownloadManager(2)
+
+    def run_downloads(name):
+        uris = ["%s-%s" % (name, i) for i in range(0, 3)]
+        manager.run([(uri, SlowDownloader(uri, active, peaks), None) for uri in uris])
+
+    # Like the components of a persona downloading at the same time
+    workers.run_graph(['a', 'b', 'c', 'd'], dict(), run_downloads, 4)
+    assert len(peaks) == 12
+    assert max(peaks) <= 2
+
+
+def test_git_mirror_paths():
+    mirror = down.GitMirror(None, '/mirrors')
+    nova = mirror._mirror_path('git://github.com/openstack/nova.git')
+    assert nova.startswith('/mirrors/nova-') and nova.endswith('.git')
+    assert nova != mirror._mirror_path('git://example.com/nova.git')
+    assert mirror._is_stale('/mirrors-that-do-not-exist')
+
+
+GIT_COMMANDS = {
+    'git': {
+        'cat-file': ['git', 'cat-file'],
+        'checkout': ['git', 'checkout', '-q'],
+        'clone': ['git', 'clone', '-q'],
+        'fetch': ['git', 'fetch', '-q'],
+        'merge': ['git', 'merge', '-q'],
+        'rev-parse': ['git', 'rev-parse'],
+    },
+}
+
+
+def _git(where, *args):
+    cmd = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+    (stdout, _) = sh.execute(*(cmd + list(args)), cwd=where)
+    return stdout.strip()
+
+
+def _commit(where, what):
+    sh.write_file(sh.joinpths(where, 'file'), what)
+    _git(where, 'add', 'file')
+    _git(where, 'commit', '-q', '-m', what)
+    return _git(where, 'rev-parse', 'HEAD')
+
+
+def _upstream(tdir):
+    upstream = sh.joinpths(tdir, 'upstream')
+    sh.mkdirslist(upstream)
+    _git(upstream, 'init', '-q')
+    _git(upstream, 'checkout', '-q', '-b', 'master')
+    return upstream
+
+
+def test_git_update_to_sha_like_branch():
+    d = distro.Distro('fake', 'ignore', 'apt', GIT_COMMANDS, {})
+    with utils.tempdir() as tdir:
+        upstream = _upstream(tdir)
+        first = _commit(upstream, 'first')
+        # A branch whose name looks like a sha
+        branch = 'deadbeef'
+        _git(upstream, 'checkout', '-q', '-b', branch)
+        second = _commit(upstream, 'second')
+        _git(upstream, 'checkout', '-q', 'master')
+        uri = "file://%s" % (upstream)
+        where = sh.joinpths(tdir, 'checkout')
+        # Shallow clones only know about the branch they were cloned at
+        down.GitDownloader(d, uri, where, 'master', depth=1).download()
+        assert down.git_head(d, where) == first
+        down.GitDownloader(d, uri, where, branch, depth=1).download()
+        assert down.git_head(d, where) == second
+        # Fixed revisions that are already there are just checked out (the
+        # upstream is gone so that would fail if it was fetched from)
+        sh.move(upstream, sh.joinpths(tdir, 'gone'))
+        down.GitDownloader(d, uri, where, first).download()
+        assert down.git_head(d, where) == first
+
+
+def test_git_update_shallow_branch():
+    d = distro.Distro('fake', 'ignore', 'apt', GIT_COMMANDS, {})
+    with utils.tempdir() as tdir:
+        upstream = _upstream(tdir)
+        _commit(upstream, 'first')
+        _commit(upstream, 'second')
+        uri = "file://%s" % (upstream)
+        where = sh.joinpths(tdir, 'checkout')
+        down.GitDownloader(d, uri, where, 'master', depth=1).download()
+        # Upstream moves on and the (shallow) checkout follows it
+        for what in ['third', 'fourth']:
+            latest = _commit(upstream, what)
+            down.GitDownloader(d, uri, where, 'master', depth=1).download()
+            assert down.git_head(d, where) == latest
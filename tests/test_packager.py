@@ -0,0 +1,101 @@
+from devstack import exceptions as excp
+from devstack import packager
+from devstack.packaging import apt
+
+
+class FakeAptPackager(apt.AptPackager):
+    def __init__(self, installed=None):
+        apt.AptPackager.__init__(self, None, False)
+        self.cmds = list()
+        self.specials = list()
+        self.already_installed = installed or dict()
+
+    def _load_installed(self):
+        return dict(self.already_installed)
+
+    def _execute_apt(self, cmd, **kargs):
+        self.cmds.append(cmd)
+        return ('', '')
+
+    def _install_special(self, name, info):
+        if name == 'special':
+            # Like the rhel relinks (done even when the package is there)
+            self.specials.append(name)
+            if not self._is_installed(info):
+                self._execute_apt(apt.APT_INSTALL + [name])
+            return True
+        return False
+
+
+def test_install_batch():
+    p = FakeAptPackager()
+    pkgs = [{'name': 'a'}, {'name': 'b', 'version': '1.0'},
+            {'name': 'special'}, {'name': 'a'}]
+    p.install_batch(pkgs)
+    assert p.cmds == [apt.APT_INSTALL + ['special'],
+                      apt.APT_INSTALL + ['a', 'b=1.0']]
+    # Already installed during this run
+    p.install_batch([{'name': 'b', 'version': '1.0'}])
+    assert len(p.cmds) == 2
+
+
+def test_install_batch_chunks():
+    p = FakeAptPackager()
+    pkgs = [{'name': 'p%s' % (i)} for i in range(0, packager.MAX_BATCH + 1)]
+    progress = list()
+    p.install_batch(pkgs, progress.append)
+    assert len(p.cmds) == 2
+    assert progress[-1] == len(pkgs)
+
+
+def test_remove_batch():
+    p = FakeAptPackager()
+    pkgs = [{'name': 'a'}, {'name': 'kept', 'removable': False},
+            {'name': 'b', 'version': '1.0'}, {'name': 'a'}]
+    removed = p.remove_batch(pkgs)
+    assert removed == ['a', 'b']
+    # Another components packages end up in the same transaction
+    assert p.remove_batch([{'name': 'c'}, {'name': 'a'}]) == ['c', 'a']
+    assert p.cmds == []
+    p.finish()
+    p.finish()
+    assert p.cmds == [apt.APT_DO_REMOVE + ['a', 'b=1.0', 'c'], apt.APT_AUTOREMOVE]
+
+
+def test_special_skips_installed():
+    p = FakeAptPackager({'special': '1.0'})
+    p.install_batch([{'name': 'special'}, {'name': 'a'}])
+    assert p.cmds == [apt.APT_INSTALL + ['a']]
+    assert p.specials == ['special']
+    assert p.skipped == 1
+
+
+def test_install_skips_installed():
+    p = FakeAptPackager({'a': '5.1.2-1', 'b': '1.0'})
+    p.install_batch([{'name': 'a', 'version': '5.1*'}, {'name': 'b'}, {'name': 'c'}])
+    p.install_batch([{'name': 'b', 'version': '2.0'}])
+    assert p.cmds == [apt.APT_INSTALL + ['c'], apt.APT_INSTALL + ['b=2.0']]
+    assert p.skipped == 2
+    assert p.installed['b'] == '2.0'
+    p.remove_batch([{'name': 'c'}])
+    p.finish()
+    assert 'c' not in p.installed
+
+
+def test_merge_versions():
+    pkgs = [{'name': 'sqlalchemy', 'version': '0.6*'}, {'name': 'paste'},
+            {'name': 'pastedeploy', 'version': '1.5*'},
+            {'name': 'sqlalchemy', 'version': '0.6.8*'},
+            {'name': 'pastedeploy', 'version': '1.5.0-2'},
+            {'name': 'pastedeploy', 'version': '1.5.0*'}]
+    assert packager.merge(pkgs) == [{'name': 'sqlalchemy', 'version': '0.6.8*'},
+                                    {'name': 'paste'},
+                                    {'name': 'pastedeploy', 'version': '1.5.0-2'}]
+    try:
+        packager.merge([{'name': 'a', 'version': '0.6*'}, {'name': 'a', 'version': '0.7*'}])
+        assert False, "Conflict not detected"
+    except excp.DependencyException:
+        pass
+    p = FakeAptPackager()
+    p.install_batch(pkgs)
+    assert p.cmds == [apt.APT_INSTALL + ['sqlalchemy=0.6.8*', 'paste', 'pastedeploy=1.5.0-2']]
@@ -0,0 +1,109 @@
+import os
+
+import yaml
+
+from devstack import distro
+from devstack import exceptions as excp
+from devstack import pip
+from devstack import shell as sh
+from devstack import utils
+
+
+def test_merge_pips():
+    pips = [{'name': 'a'}, {'name': 'b', 'version': '1.0'},
+            {'name': 'a', 'version': '2.0', 'options': '--upgrade'},
+            {'name': 'b'}]
+    assert pip.merge(pips) == [{'name': 'a', 'version': '2.0', 'options': '--upgrade'},
+                               {'name': 'b', 'version': '1.0'}]
+
+
+def test_merge_conflicting_pips():
+    try:
+        pip.merge([{'name': 'a', 'version': '1.0'}, {'name': 'a', 'version': '2.0'}])
+        assert False, "Conflict not detected"
+    except excp.DependencyException:
+        pass
+
+
+def test_merge_all_reports_who_conflicts():
+    wanted = [('nova', [{'name': 'a', 'version': '1.0'}, {'name': 'b'}]),
+              ('glance', [{'name': 'a', 'version': '2.0'}, {'name': 'b', 'version': '3.0'}])]
+    try:
+        pip.merge_all(wanted)
+        assert False, "Conflict not detected"
+    except excp.DependencyException as e:
+        assert 'nova wants 1.0' in str(e)
+        assert 'glance wants 2.0' in str(e)
+    wanted[1] = ('glance', [{'name': 'b', 'version': '3.0'}])
+    assert pip.merge_all(wanted) == [{'name': 'a', 'version': '1.0'},
+                                     {'name': 'b', 'version': '3.0'}]
+
+
+# Records its arguments and only installs from the cache once a wheel was built
+FAKE_PIP = """#!/bin/sh
+echo "$@" >> %(log)s
+case "$1 $3" in
+    "install --no-index") test -f %(built)s ;;
+    "wheel "*) touch %(built)s ;;
+esac
+"""
+
+
+def _fake_pip(tdir):
+    log_fn = sh.joinpths(tdir, 'pip.log')
+    pip_fn = sh.joinpths(tdir, 'pip')
+    sh.write_file(pip_fn, FAKE_PIP % {'log': log_fn, 'built': sh.joinpths(tdir, 'built')})
+    sh.chmod(pip_fn, 0755)
+    return (distro.Distro('fake', 'ignore', 'apt', {'pip': pip_fn}, {}), log_fn)
+
+
+def _ran(log_fn):
+    # The requirements file is in a temporary directory, drop it
+    return [line.split()[0:-1] for line in sh.load_file(log_fn).splitlines()]
+
+
+def test_install_cache_miss():
+    with utils.tempdir() as tdir:
+        (d, log_fn) = _fake_pip(tdir)
+        cache_dir = sh.joinpths(tdir, 'cache')
+        pips = [{'name': 'a', 'version': '1.0', 'options': '--pre'},
+                {'name': 'b', 'options': '--upgrade'}]
+        pip.install_batch(pips, d, cache_dir)
+        cached = ['install'] + pip.PIP_INSTALL_CMD_OPTS + pip.PIP_CACHED_CMD_OPTS + [cache_dir]
+        # The wheels are built with the same options (less the install only
+        # ones) and each set of options gets its own pip run
+        assert _ran(log_fn) == [cached + ['--pre', '-r'],
+                                ['wheel'] + pip.PIP_WHEEL_CMD_OPTS + [cache_dir, '--pre', '-r'],
+                                cached + ['--pre', '-r'],
+                                cached + ['--upgrade', '-r']]
+
+
+def test_install_cache_hit():
+    with utils.tempdir() as tdir:
+        (d, log_fn) = _fake_pip(tdir)
+        sh.touch_file(sh.joinpths(tdir, 'built'))
+        cache_dir = sh.joinpths(tdir, 'cache')
+        pip.install_batch([{'name': 'a', 'options': '--pre'}], d, cache_dir)
+        assert _ran(log_fn) == [['install'] + pip.PIP_INSTALL_CMD_OPTS + pip.PIP_CACHED_CMD_OPTS +
+                                [cache_dir, '--pre', '-r']]
+
+
+def test_merge_all_normalizes_versions():
+    wanted = [('keystone', [{'name': 'PasteDeploy', 'version': '1.5'}]),
+              ('glance', [{'name': 'PasteDeploy', 'version': '1.5.0'}])]
+    assert pip.merge_all(wanted) == [{'name': 'PasteDeploy', 'version': '1.5'}]
+
+
+def test_merge_all_rhel6_pips():
+    conf_dir = sh.joinpths(sh.dirname(sh.abspth(__file__)), os.pardir, 'conf')
+    rhel = yaml.safe_load(sh.load_file(sh.joinpths(conf_dir, 'distros', 'rhel-6.yaml')))
+    devstack = yaml.safe_load(sh.load_file(sh.joinpths(conf_dir, 'personas', 'devstack.sh.yaml')))
+    wanted = list()
+    for name in devstack['components']:
+        info = rhel['components'][name]
+        pips = list(info.get('pips') or list())
+        for subsystem in devstack['subsystems'].get(name, list()):
+            pips.extend(info.get('subsystems', dict()).get(subsystem, dict()).get('pips') or list())
+        wanted.append((name, pips))
+    merged = pip.merge_all(wanted)
+    assert 'PasteDeploy' in [p['name'] for p in merged]
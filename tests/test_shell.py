@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from devstack import exceptions as excp
+from devstack import shell as sh
+from devstack import trace as tr
+from devstack import utils
+
+
+def test_write_file_if_changed():
+    with utils.tempdir() as tdir:
+        fn = sh.joinpths(tdir, 'a.conf')
+        assert sh.write_file_if_changed(fn, 'a=b') == sh.FILE_CREATED
+        os.chmod(fn, 0600)
+        mtime = sh.getmtime(fn)
+        assert sh.write_file_if_changed(fn, 'a=b') == sh.FILE_UNCHANGED
+        assert sh.getmtime(fn) == mtime
+        assert sh.write_file_if_changed(fn, 'a=c') == sh.FILE_MODIFIED
+        assert sh.load_file(fn) == 'a=c'
+        assert (os.stat(fn).st_mode & 0777) == 0600
+        assert os.listdir(tdir) == ['a.conf']
+
+
+def test_trace_changed_configs():
+    with utils.tempdir() as tdir:
+        trace_fn = sh.joinpths(tdir, 'install.trace')
+        writer = tr.TraceWriter(trace_fn)
+        writer.cfg_file_written('/a', 'a', sh.FILE_CREATED)
+        writer.cfg_file_written('/b', 'b', sh.FILE_UNCHANGED)
+        writer.cfg_file_written('/a', 'a', sh.FILE_UNCHANGED)
+        writer.cfg_file_written('/c', 'c', sh.FILE_MODIFIED)
+        assert tr.TraceReader(trace_fn).files_configured_changed() == ['/c']
+
+
+def test_gather():
+    started = time.time()
+    pendings = [sh.execute_async('sleep', '0.5'),
+                sh.execute_async('cat', process_input='hello'),
+                sh.execute_async('sh', '-c', 'echo $FOO >&2', env_overrides={'FOO': 'bar'})]
+    results = sh.gather(*pendings)
+    assert time.time() - started < 1.5
+    assert results == [('', ''), ('hello', ''), ('', 'bar\n')]
+    assert pendings[1].result() == ('hello', '')
+
+
+def test_gather_failure():
+    pendings = [sh.execute_async('false'),
+                sh.execute_async('false', check_exit_code=False)]
+    try:
+        sh.gather(*pendings)
+        assert False, "Failure not raised"
+    except excp.ProcessExecutionError:
+        pass
+    assert pendings[1].value == ('', '')
+    assert pendings[1].rc == 1
+
+
+def test_streamed_output():
+    with utils.tempdir() as tdir:
+        output_fn = sh.joinpths(tdir, 'out', 'cmd.log')
+        script = 'for i in $(seq 1 200); do echo $i; done; echo bad >&2; printf end'
+        (stdout, stderr) = sh.execute('sh', '-c', script, output_fn=output_fn)
+        assert stdout.filename == output_fn
+        assert stdout.splitlines() == ([str(i) for i in range(200 - sh.OUTPUT_TAIL_LINES + 3, 201)]
+                                       + ['bad', 'end'])
+        # The command goes first
+        assert len(sh.load_file(output_fn).splitlines()) == 203
+        try:
+            sh.execute('sh', '-c', 'echo broken; exit 2', output_fn=output_fn)
+            assert False, "Failure not raised"
+        except excp.ProcessExecutionError as e:
+            assert 'broken' in str(e)
+        # Later commands append to the same log
+        lines = sh.load_file(output_fn).splitlines()
+        assert lines[203:] == ["$ sh -c echo broken; exit 2", 'broken']
+
+
+def test_streamed_output_dryrun():
+    sh.set_dryrun(True)
+    try:
+        (stdout, _) = sh.execute('false', output_fn='/does/not/exist.log')
+    finally:
+        sh.set_dryrun(False)
+    assert stdout.filename == '/does/not/exist.log'
+    assert stdout == ''
+
+
+def test_rooted_serialized():
+    active = list()
+    overlapped = list()
+
+    def run_rooted():
+        with sh.Rooted(True):
+            active.append(1)
+            if len(active) > 1:
+                overlapped.append(1)
+            time.sleep(0.05)
+            active.pop()
+
+    threads = [threading.Thread(target=run_rooted) for i in range(0, 4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not overlapped
+
+
+def test_write_file_if_changed_waits_for_rooted():
+    with utils.tempdir() as tdir:
+        fn = sh.joinpths(tdir, 'cfg')
+        entered = threading.Event()
+        release = threading.Event()
+        seen = list()
+
+        def run_rooted():
+            with sh.Rooted(True):
+                entered.set()
+                release.wait(5)
+                seen.append(sh.isfile(fn))
+
+        t = threading.Thread(target=run_rooted)
+        t.start()
+        entered.wait(5)
+        writer = threading.Thread(target=sh.write_file_if_changed, args=(fn, 'a=b'))
+        writer.start()
+        time.sleep(0.05)
+        release.set()
+        writer.join()
+        t.join()
+        # Nothing was made as the user while another thread was rooted
+        assert seen == [False]
+        assert sh.load_file(fn) == 'a=b'
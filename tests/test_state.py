@@ -0,0 +1,72 @@
+from devstack import settings
+from devstack import shell as sh
+from devstack import state
+from devstack import trace as tr
+from devstack import utils
+
+
+def _trace_fn(root_dir, component):
+    return tr.trace_fn(sh.joinpths(root_dir, component, settings.COMPONENT_TRACE_DIR), tr.IN_TRACE)
+
+
+def test_state_store():
+    with utils.tempdir() as root_dir:
+        # An existing (v1) trace that gets imported
+        nova_fn = _trace_fn(root_dir, 'nova')
+        writer = tr.TraceWriter(nova_fn)
+        writer.dirs_made('/etc/nova')
+        writer.package_installed({'name': 'a'})
+        store = state.StateStore(sh.joinpths(root_dir, state.STATE_FN))
+        assert store.import_root(root_dir) > 0
+        tr.set_state_store(store)
+        try:
+            glance_fn = _trace_fn(root_dir, 'glance')
+            writer = tr.TraceWriter(glance_fn)
+            writer.dirs_made('/etc/nova', '/etc/glance')
+            writer.started_info('glance-api', '/tmp/glance-api.trace')
+            tr.sync_all()
+            reader = tr.TraceReader(nova_fn)
+            assert reader.components_with('/etc/nova') == ['glance', 'nova']
+            assert reader.actions(tr.PKG_INSTALL) == ['{"name": "a"}']
+            assert store.apps_started() == {'glance': ['glance-api']}
+            sh.unlink(glance_fn)
+            store.prune()
+            assert reader.components_with('/etc/nova') == ['nova']
+        finally:
+            tr.set_state_store(None)
+            store.close()
+
+
+def test_enable_refreshes_changed_traces():
+    with utils.tempdir() as root_dir:
+        nova_fn = _trace_fn(root_dir, 'nova')
+        tr.TraceWriter(nova_fn).dirs_made('/etc/nova')
+        try:
+            store = state.enable(root_dir)
+            assert store.components_with('/etc/nova') == ['nova']
+            # Mirrored as it is written so it is not seen as changed later
+            tr.TraceWriter(_trace_fn(root_dir, 'glance')).dirs_made('/etc/glance')
+            tr.sync_all()
+            assert store.refresh(root_dir) == 0
+        finally:
+            tr.set_state_store(None)
+            state._STORE = None
+            store.close()
+        # Written to by a run that was not mirroring its traces
+        tr.TraceWriter(nova_fn, break_if_there=False).dirs_made('/etc/nova-extra')
+        try:
+            store = state.enable(root_dir)
+            assert store.components_with('/etc/nova-extra') == ['nova']
+            assert store.components_with('/etc/glance') == ['glance']
+            assert store.refresh(root_dir) == 0
+        finally:
+            tr.set_state_store(None)
+            state._STORE = None
+            store.close()
+        store = state.StateStore(sh.joinpths(root_dir, state.STATE_FN))
+        try:
+            sh.unlink(nova_fn)
+            assert store.prune() == 1
+            assert store.refresh(root_dir) == 0
+        finally:
+            store.close()
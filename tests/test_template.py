@@ -0,0 +1,50 @@
+from devstack import exceptions as excp
+from devstack import shell as sh
+from devstack import template
+from devstack import utils
+
+
+def test_render():
+    text = "a=%A%\n# b=%B%\nc=%C%:%A%"
+    tpl = template.compile_template(text)
+    assert tpl.params == ['A', 'C', 'A']
+    assert tpl.render({'A': 1, 'C': 'x'}) == "a=1\n# b=%B%\nc=x:1"
+    assert tpl.render({'A': 1}, ignore_missing=True) == "a=1\n# b=%B%\nc=%C%:1"
+    assert template.compile_template(text) is tpl
+    assert utils.param_replace(text, {'A': 1, 'C': 'x'}) == tpl.render({'A': 1, 'C': 'x'})
+    assert utils.find_params(text) == set(['A', 'C'])
+
+
+def test_missing():
+    try:
+        utils.param_replace("%A% %B%", {'A': 1})
+        assert False, "Missing parameter not detected"
+    except excp.NoReplacementException:
+        pass
+
+
+def test_load_changed():
+    with utils.tempdir() as tdir:
+        fn = sh.write_file(sh.joinpths(tdir, 'a.tpl'), "%A%")
+        tpl = template.load(fn)
+        assert template.load(fn) is tpl
+        sh.write_file(fn, "%B%")
+        # Pretend it was loaded a long time ago
+        template._BY_PATH[fn] = (0, tpl)
+        assert template.load(fn).params == ['B']
+
+
+def test_registry_bundle():
+    with utils.tempdir() as tdir:
+        tpl_dir = sh.joinpths(tdir, 'templates')
+        sh.mkdirslist(sh.joinpths(tpl_dir, 'a'))
+        fn = sh.write_file(sh.joinpths(tpl_dir, 'a', 'b.conf'), "b=%B%")
+        bundle_fn = sh.joinpths(tdir, 'templates.bundle')
+        assert template.Registry(tpl_dir).write_bundle(bundle_fn) == 1
+        # The bundle wins while it is newer than the templates
+        sh.unlink(fn)
+        registry = template.Registry(tpl_dir, bundle_fn)
+        (path, tpl) = registry.get('a', 'b.conf')
+        assert path == fn
+        assert tpl.text == "b=%B%"
+        assert registry.preload() == 0
@@ -0,0 +1,24 @@
+import json
+
+from devstack import timeline
+
+
+def test_span_nesting():
+    timeline.enable()
+    try:
+        with timeline.span("nova: install", timeline.PHASE_CAT, component='nova'):
+            with timeline.span("apt-get install -y " + ("x" * 100), timeline.CMD_CAT):
+                pass
+        events = json.loads(timeline.dump())['traceEvents']
+        (cmd, phase) = events[-2:]
+        if cmd['cat'] != timeline.CMD_CAT:
+            (cmd, phase) = (phase, cmd)
+        assert phase['name'] == "nova: install"
+        assert phase['ph'] == timeline.COMPLETE_EVENT
+        assert cmd['args']['component'] == 'nova'
+        assert len(cmd['name']) <= timeline.MAX_NAME_LEN + 3
+        assert phase['ts'] <= cmd['ts']
+        assert cmd['ts'] + cmd['dur'] <= phase['ts'] + phase['dur']
+    finally:
+        timeline.disable()
+    assert not timeline.is_enabled()
@@ -0,0 +1,61 @@
+from devstack import shell as sh
+from devstack import trace as tr
+from devstack import utils
+
+
+def test_buffered_writer():
+    with utils.tempdir() as root_dir:
+        fn = tr.trace_fn(root_dir, 'buffered')
+        writer = tr.TraceWriter(fn, buffered=True)
+        writer.dirs_made('/a', '/b')
+        # Nothing but the header written until synced
+        assert tr.TraceReader(fn).dirs_made() == list()
+        tr.sync_all()
+        assert tr.TraceReader(fn).dirs_made() == ['/b', '/a']
+        writer.dirs_made(*['/c%s' % (i) for i in range(0, tr.BUFFER_LINES)])
+        assert len(tr.TraceReader(fn).dirs_made()) == tr.BUFFER_LINES + 2
+        writer.sync()
+
+
+def test_partial_line_ignored():
+    with utils.tempdir() as root_dir:
+        fn = tr.trace_fn(root_dir, 'partial')
+        writer = tr.TraceWriter(fn)
+        writer.file_touched('/a')
+        sh.append_file(fn, "%s - /b" % (tr.FILE_TOUCHED))
+        assert tr.TraceReader(fn).files_touched() == ['/a']
+
+
+def test_reader_index():
+    with utils.tempdir() as root_dir:
+        fn = tr.trace_fn(root_dir, 'index')
+        writer = tr.TraceWriter(fn)
+        writer.package_installed({'name': 'a'})
+        writer.dirs_made('/a')
+        writer.package_installed({'name': 'b'})
+        writer.pip_installed({'name': 'c'})
+        reader = tr.TraceReader(fn)
+        assert reader.packages_installed() == [{'name': 'a'}, {'name': 'b'}]
+        assert reader.pips_installed() == [{'name': 'c'}]
+        assert reader.dirs_made() == ['/a']
+        assert len(list(reader.read())) == 5
+        assert reader._entries(tr.PKG_INSTALL) is reader._entries(tr.PKG_INSTALL)
+
+
+def test_compact():
+    with utils.tempdir() as root_dir:
+        fn = tr.trace_fn(root_dir, 'compact')
+        writer = tr.TraceWriter(fn)
+        writer.dirs_made('/a', '/b')
+        writer.started_info('api', '/tmp/api-1.trace')
+        writer.dirs_made('/a')
+        writer.package_installed({'name': 'a'})
+        writer.started_info('api', '/tmp/api-2.trace')
+        writer.package_installed({'name': 'a'})
+        (before, after) = tr.compact(fn)
+        assert (before, after) == (8, 5)
+        reader = tr.TraceReader(fn)
+        assert reader.dirs_made() == ['/b', '/a']
+        assert reader.apps_started() == [('/tmp/api-2.trace', 'api')]
+        assert reader.packages_installed() == [{'name': 'a'}]
+        assert next(reader.read()) == (tr.TRACE_VERSION, str(tr.TRACE_VER))
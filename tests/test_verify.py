@@ -0,0 +1,67 @@
+from devstack import distro
+from devstack import settings
+from devstack import shell as sh
+from devstack import trace as tr
+from devstack import utils
+
+from devstack.progs import verify
+
+
+def test_verify_drift():
+    with utils.tempdir() as root_dir:
+        trace_dir = sh.joinpths(root_dir, 'a', settings.COMPONENT_TRACE_DIR)
+        cfg_dir = sh.joinpths(root_dir, 'a', settings.COMPONENT_CONFIG_DIR)
+        writer = tr.TraceWriter(tr.trace_fn(trace_dir, tr.IN_TRACE))
+        writer.dirs_made(*sh.mkdirslist(cfg_dir))
+        same_fn = sh.joinpths(cfg_dir, 'same.conf')
+        changed_fn = sh.joinpths(cfg_dir, 'changed.conf')
+        gone_fn = sh.joinpths(cfg_dir, 'gone.conf')
+        for fn in [same_fn, changed_fn]:
+            writer.cfg_file_written(sh.write_file(fn, 'a=b'), 'a=b')
+        writer.cfg_file_written(gone_fn, 'c=d')
+        sh.write_file(changed_fn, 'a=c')
+        extra_fn = sh.write_file(sh.joinpths(cfg_dir, 'extra.conf'), 'e=f')
+        drift = verify.Verifier(root_dir, ['a', 'b'], max_workers=3).verify()
+    assert sorted(drift) == sorted([('a', verify.MODIFIED, changed_fn),
+                                    ('a', verify.MISSING, gone_fn),
+                                    ('a', verify.EXTRA, extra_fn)])
+
+
+def test_verify_removed_on_purpose():
+    with utils.tempdir() as root_dir:
+        trace_dir = sh.joinpths(root_dir, 'a', settings.COMPONENT_TRACE_DIR)
+        cfg_dir = sh.joinpths(root_dir, 'a', settings.COMPONENT_CONFIG_DIR)
+        writer = tr.TraceWriter(tr.trace_fn(trace_dir, tr.IN_TRACE))
+        writer.dirs_made(*sh.mkdirslist(cfg_dir))
+        # Like swift does with its server config templates and scripts
+        template_fn = sh.joinpths(cfg_dir, 'object-server.conf')
+        writer.cfg_file_written(sh.write_file(template_fn, 'a=b'), 'a=b')
+        sh.unlink(template_fn)
+        writer.file_removed(template_fn)
+        script_fn = sh.joinpths(cfg_dir, 'remakerings')
+        writer.cfg_file_written(sh.write_file(script_fn, 'true'), 'true')
+        moved_fn = sh.joinpths(root_dir, 'a', 'remakerings')
+        sh.move(script_fn, moved_fn)
+        writer.file_removed(script_fn)
+        writer.file_touched(moved_fn)
+        drift = verify.Verifier(root_dir, ['a']).verify()
+    assert drift == []
+
+
+def test_verify_extras_in_checkout():
+    d = distro.Distro('fake', 'ignore', 'apt', {'git': {'ls-files': ['git', 'ls-files']}}, {})
+    with utils.tempdir() as root_dir:
+        trace_dir = sh.joinpths(root_dir, 'a', settings.COMPONENT_TRACE_DIR)
+        app_dir = sh.joinpths(root_dir, 'a', 'app')
+        etc_dir = sh.joinpths(app_dir, 'etc')
+        sh.mkdirslist(etc_dir)
+        shipped_fn = sh.write_file(sh.joinpths(etc_dir, 'policy.json'), '{}')
+        sh.execute('git', 'init', '-q', cwd=app_dir)
+        sh.execute('git', 'add', shipped_fn, cwd=app_dir)
+        writer = tr.TraceWriter(tr.trace_fn(trace_dir, tr.IN_TRACE))
+        writer.download_happened(app_dir, 'git://example.com/a.git')
+        # Configs written next to the ones that come with the checkout
+        writer.cfg_file_written(sh.write_file(sh.joinpths(etc_dir, 'a.conf'), 'a=b'), 'a=b')
+        extra_fn = sh.write_file(sh.joinpths(etc_dir, 'extra.conf'), 'e=f')
+        drift = verify.Verifier(root_dir, ['a'], distro=d).verify()
+    assert drift == [('a', verify.EXTRA, extra_fn)]
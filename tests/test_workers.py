@@ -0,0 +1,58 @@
+import threading
+
+from devstack import exceptions as excp
+from devstack import workers
+
+
+def test_topological_order_keeps_preference():
+    deps = {'a': set(), 'b': set(['a']), 'c': set(['a'])}
+    assert workers.topological_order(['a', 'c', 'b'], deps) == ['a', 'c', 'b']
+    assert workers.topological_order(['b', 'a'], deps) == ['a', 'b']
+
+
+def test_topological_order_cycle():
+    deps = {'a': set(['b']), 'b': set(['a'])}
+    try:
+        workers.topological_order(['a', 'b'], deps)
+        assert False, "Cycle not detected"
+    except excp.DependencyException:
+        pass
+
+
+def test_invert_dependencies():
+    deps = {'a': set(), 'b': set(['a']), 'c': set(['a', 'b'])}
+    inverted = workers.invert_dependencies(['a', 'b', 'c'], deps)
+    assert inverted == {'a': set(['b', 'c']), 'b': set(['c']), 'c': set()}
+
+
+def test_run_graph_respects_dependencies():
+    deps = {'a': set(), 'b': set(['a']), 'c': set(['a']), 'd': set(['b', 'c'])}
+    lock = threading.Lock()
+    finished = list()
+
+    def functor(node):
+        with lock:
+            for d in deps[node]:
+                assert d in finished
+            finished.append(node)
+
+    workers.run_graph(['a', 'b', 'c', 'd'], deps, functor, 3)
+    assert sorted(finished) == ['a', 'b', 'c', 'd']
+    assert finished[0] == 'a' and finished[-1] == 'd'
+
+
+def test_run_graph_failure():
+    deps = {'a': set(), 'b': set(['a'])}
+    ran = list()
+
+    def functor(node):
+        ran.append(node)
+        if node == 'a':
+            raise IOError("broken")
+
+    try:
+        workers.run_graph(['a', 'b'], deps, functor, 2)
+        assert False, "Failure not raised"
+    except IOError:
+        pass
+    assert ran == ['a']
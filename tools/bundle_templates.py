@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+"""Pack the templates (conf/templates) into a single bundle file (see template.Registry).
+"""
+
+import os
+import sys
+
+POSSIBLE_TOPDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from devstack import template
+
+if __name__ == "__main__":
+    template_dir = os.path.join(POSSIBLE_TOPDIR, "conf", "templates")
+    bundle_fn = os.path.join(POSSIBLE_TOPDIR, "conf", "templates.bundle")
+    if len(sys.argv) > 1:
+        bundle_fn = sys.argv[1]
+    registry = template.Registry(template_dir)
+    am_bundled = registry.write_bundle(bundle_fn)
+    print("Bundled %s templates from %s into %s" % (am_bundled, template_dir, bundle_fn))
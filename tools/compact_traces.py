@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+"""Compact the component traces of a root directory (see trace.compact).
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from devstack import trace as tr
+
+if __name__ == "__main__":
+    me = os.path.basename(sys.argv[0])
+    if len(sys.argv) < 2:
+        print("%s root_dir" % (me))
+        sys.exit(1)
+
+    root_dir = sys.argv[1]
+    for (component, trace_fn) in tr.component_traces(root_dir):
+        (before, after) = tr.compact(trace_fn)
+        print("%s: %s (%s => %s lines)" % (component, trace_fn, before, after))